@@ -0,0 +1,190 @@
+from __future__ import annotations
+import json
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Callable
+from benchmark.synthetic import SyntheticLab
+from daemon import registry
+from topology.manifest import sync
+from topology.output import LabOutput
+from topology.parser import get_topology
+from topology.wizard import (
+    configure_daemons,
+    initialize_root,
+    make_lab_conf,
+    make_startup_files,
+    merge_daemons,
+    validate_config,
+)
+
+PHASES = ["validate", "parse", "lab.conf", "startup", "merge", "render", "write"]
+
+
+class PhaseResult:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.files = 0
+        self.bytes = 0
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "seconds": self.seconds,
+            "peak_bytes": self.peak_bytes,
+            "files": self.files,
+            "bytes": self.bytes,
+        }
+
+
+def run_phases(
+    config: Path, target: Path, data: Path, jobs: int, memory: bool
+) -> dict[str, PhaseResult]:
+    # runs the same steps as wizard.generate and wizard.configure_topology
+    results = {name: PhaseResult(name) for name in PHASES}
+    output = LabOutput()
+    state: dict[str, Any] = {}
+
+    def parse():
+        state["topology"] = get_topology(config.joinpath("topology.json"))
+
+    def startup():
+        make_startup_files(output, state["topology"])
+        initialize_root(config, output, state["topology"])
+
+    def merge():
+        merge_daemons(config, state["topology"])
+        output.inputs = registry.read_inputs(config)
+
+    def render():
+        configure_daemons(output, data, state["topology"], jobs)
+        output.freeze()
+
+    def write():
+        changes = sync(output, target)
+        results["write"].files = len(changes.written)
+        results["write"].bytes = sum(
+            target.joinpath(path).stat().st_size for path in changes.written
+        )
+
+    steps: list[tuple[str, Callable[[], None]]] = [
+        ("validate", lambda: validate_config(config)),
+        ("parse", parse),
+        ("lab.conf", lambda: make_lab_conf(output, state["topology"])),
+        ("startup", startup),
+        ("merge", merge),
+        ("render", render),
+        ("write", write),
+    ]
+    for name, step in steps:
+        files = len(output.files)
+        if memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        step()
+        results[name].seconds = time.perf_counter() - start
+        if memory:
+            results[name].peak_bytes = tracemalloc.get_traced_memory()[1]
+        if name != "write":
+            results[name].files = len(output.files) - files
+    return results
+
+
+def benchmark(config: Path, data: Path, jobs: int, repeat: int) -> dict[str, Any]:
+    best: dict[str, PhaseResult] = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as target:
+            results = run_phases(config, Path(target, "lab"), data, jobs, False)
+        for name, result in results.items():
+            if name not in best or result.seconds < best[name].seconds:
+                best[name] = result
+
+    # memory is measured in a separate run because tracing slows everything down
+    tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as target:
+            traced = run_phases(config, Path(target, "lab"), data, jobs, True)
+    finally:
+        tracemalloc.stop()
+    for name, result in traced.items():
+        best[name].peak_bytes = result.peak_bytes
+
+    return {name: result.to_json() for name, result in best.items()}
+
+
+def compare(
+    report: dict[str, Any], baseline: dict[str, Any], tolerance: float
+) -> list[str]:
+    regressions: list[str] = []
+    for name, phase in report["phases"].items():
+        if name not in baseline["phases"]:
+            continue
+        old = baseline["phases"][name]
+        for key in ("seconds", "peak_bytes"):
+            if old[key] > 0 and phase[key] > old[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name} {key}: {old[key]:.4g} -> {phase[key]:.4g}"
+                )
+    return regressions
+
+
+def print_report(report: dict[str, Any]):
+    print(f"{'phase':<10}{'seconds':>12}{'peak MiB':>12}{'files':>10}{'bytes':>12}")
+    for name, phase in report["phases"].items():
+        print(
+            f"{name:<10}{phase['seconds']:>12.4f}{phase['peak_bytes'] / 2**20:>12.2f}"
+            f"{phase['files']:>10}{phase['bytes']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Times each phase of the lab generation")
+    parser.add_argument(
+        "--config", type=Path, help="use this config instead of a synthetic one"
+    )
+    parser.add_argument("--routers", type=int, default=100)
+    parser.add_argument("--lans", type=int, default=0)
+    parser.add_argument("--ases", type=int, default=4)
+    parser.add_argument("--areas", type=int, default=2)
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--zone-depth", type=int, default=2)
+    parser.add_argument("--zone-fanout", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data", type=Path, default=Path("data"))
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", type=Path, help="json report to compare with")
+    parser.add_argument("--save", type=Path, help="where to save the json report")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    sizes = ["routers", "lans", "ases", "areas", "hosts", "zone_depth", "zone_fanout"]
+    params = {key: getattr(args, key) for key in sizes + ["seed", "jobs"]}
+    with tempfile.TemporaryDirectory() as folder:
+        config: Path = args.config
+        if config is None:
+            config = Path(folder)
+            lab = SyntheticLab(**{k: v for k, v in params.items() if k != "jobs"})
+            lab.write(config)
+        else:
+            params = {"config": config.as_posix(), "jobs": args.jobs}
+        phases = benchmark(config, args.data, args.jobs, args.repeat)
+        report = {"params": params, "phases": phases}
+
+    print_report(report)
+    if args.save is not None:
+        with args.save.open("w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline is not None:
+        with args.baseline.open("r") as f:
+            baseline = json.load(f)
+        if baseline["params"] != report["params"]:
+            print("Warning: the baseline was run with different parameters")
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print("Regression: " + line)
+        if regressions:
+            exit(1)
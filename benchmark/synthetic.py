@@ -0,0 +1,168 @@
+from __future__ import annotations
+import json
+import random
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+
+class SyntheticLab:
+    # Builds the json files of a lab with the requested size: the routers of
+    # each AS are chained together, the first router of each AS is linked to
+    # the next AS, extra links make meshes and every host sits on a stub lan.
+    def __init__(
+        self,
+        routers: int = 100,
+        lans: int = 0,
+        ases: int = 4,
+        areas: int = 2,
+        hosts: int = 100,
+        zone_depth: int = 2,
+        zone_fanout: int = 3,
+        seed: int = 0,
+    ) -> None:
+        self.random = random.Random(seed)
+        self.lans: dict[str, str] = {}
+        self.routers: dict[str, dict[str, str]] = {}
+        self.defaults: list[str] = []
+        self.as_routers: dict[int, list[str]] = defaultdict(list)
+        self.as_lans: dict[int, list[str]] = defaultdict(list)
+        self.stubs: dict[str, tuple[str, int]] = {}
+
+        for i in range(routers):
+            asn = i % ases + 1
+            name = f"as{asn}r{len(self.as_routers[asn]) + 1}"
+            self.as_routers[asn].append(name)
+            self.routers[name] = {}
+        self.router_names = list(self.routers)
+
+        for asn, members in self.as_routers.items():
+            for left, right in zip(members, members[1:]):
+                self.link(asn, left, right)
+        as_numbers = sorted(self.as_routers)
+        for left, right in zip(as_numbers, as_numbers[1:]):
+            self.link(None, self.as_routers[left][0], self.as_routers[right][0])
+
+        # extra links inside the ASes until the lans are enough
+        while len(self.lans) < lans:
+            asn = self.random.choice(as_numbers)
+            if len(self.as_routers[asn]) < 2:
+                break
+            left, right = self.random.sample(self.as_routers[asn], 2)
+            self.link(asn, left, right)
+
+        self.host_names = [self.add_host(f"h{i}") for i in range(hosts)]
+
+        self.ospf = self.make_ospf(areas)
+        self.rip = self.make_rip()
+        self.bgp = {
+            "AS": [f"{asn} " + " ".join(self.as_routers[asn]) for asn in as_numbers]
+        }
+        self.dns = self.make_dns(zone_depth, zone_fanout)
+
+    def new_lan(self) -> str:
+        n = len(self.lans)
+        name = f"L{n}"
+        self.lans[name] = f"{10 + (n >> 16)}.{(n >> 8) & 255}.{n & 255}.0/24"
+        return name
+
+    def add_interface(self, router: str, byte: int, lan: str):
+        interfaces = self.routers[router]
+        interfaces[f"eth{len(interfaces)}"] = f"{byte} {lan}"
+
+    def link(self, asn: int | None, left: str, right: str):
+        lan = self.new_lan()
+        self.add_interface(left, 1, lan)
+        self.add_interface(right, 2, lan)
+        if asn is not None:
+            self.as_lans[asn].append(lan)
+
+    def add_host(self, name: str) -> str:
+        router = self.random.choice(self.router_names)
+        lan, used = self.stubs.get(router, ("", 254))
+        if used >= 254:
+            lan, used = self.new_lan(), 1
+            self.add_interface(router, 1, lan)
+        self.stubs[router] = (lan, used + 1)
+        self.routers[name] = {}
+        self.add_interface(name, used + 1, lan)
+        self.defaults.append(f"{name} {router}")
+        return name
+
+    def make_ospf(self, areas: int) -> dict[str, Any]:
+        backbones: dict[str, list[str]] = defaultdict(list)
+        stubs: dict[str, list[str]] = defaultdict(list)
+        routers: list[str] = []
+        costs: list[str] = []
+        for asn in sorted(self.as_routers)[::2]:
+            routers.extend(self.as_routers[asn])
+            for i, lan in enumerate(self.as_lans[asn]):
+                area = i % max(areas, 1)
+                if area == 0:
+                    backbones["0.0.0.0"].append(lan)
+                else:
+                    stubs[f"0.0.0.{area}"].append(lan)
+            for router in self.as_routers[asn][::3]:
+                costs.append(f"{router} eth0 {self.random.randint(1, 100)}")
+        return {
+            "areas": {
+                "stubs": {name: " ".join(lans) for name, lans in stubs.items()},
+                "backbones": {
+                    name: " ".join(lans) for name, lans in backbones.items()
+                },
+            },
+            "routers": routers,
+            "costs": costs,
+        }
+
+    def make_rip(self) -> dict[str, Any]:
+        routers: list[str] = []
+        for asn in sorted(self.as_routers)[1::2]:
+            routers.extend(self.as_routers[asn])
+        return {"routers": routers}
+
+    def make_dns(self, depth: int, fanout: int) -> dict[str, Any]:
+        servers = [f"root {self.add_host('rootdns')}"]
+        leaves: list[str] = []
+
+        def subtree(level: int) -> list[str] | dict[str, Any]:
+            zones = []
+            for _ in range(fanout):
+                zone = f"z{len(servers)}"
+                servers.append(f"{zone} {self.add_host(zone + 'dns')}")
+                zones.append(zone)
+            if level == depth:
+                leaves.extend(zones)
+                return zones
+            return {zone: subtree(level + 1) for zone in zones}
+
+        root = subtree(1) if depth > 0 else []
+        names: list[str] = []
+        for i, host in enumerate(self.host_names if leaves else []):
+            names.append(f"{host} {leaves[i % len(leaves)]}")
+        resolver = self.add_host("resolver")
+        return {
+            "root": root,
+            "servers": servers,
+            "names": names,
+            "resolvers": [" ".join([resolver] + self.host_names)],
+        }
+
+    def get_files(self) -> dict[str, Any]:
+        return {
+            "topology.json": {
+                "lans": self.lans,
+                "routers": self.routers,
+                "defaults": self.defaults,
+            },
+            "ospf.json": self.ospf,
+            "rip.json": self.rip,
+            "bgp.json": self.bgp,
+            "dns.json": self.dns,
+        }
+
+    def write(self, folder: Path):
+        folder.mkdir(parents=True, exist_ok=True)
+        for name, content in self.get_files().items():
+            with folder.joinpath(name).open("w") as f:
+                json.dump(content, f, indent=1)
@@ -3,12 +3,28 @@ from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Any
 from topology.classes import Router, Topology
+from topology.output import LabOutput
+from topology.validate import Index
 
 
 class Daemon(ABC):
+    # tag of the registry entry that merged this daemon, the parts of the files
+    # it writes are tagged with it
+    tag: str | None = None
+
     def add_router(self, router: Router) -> None:
         router.add_daemon(self)
 
+    def get_tag(self) -> str:
+        if self.tag is None:
+            raise ValueError(f"{type(self).__name__} was not merged by the registry")
+        return self.tag
+
+    def get_sources(self, router: Router) -> list[str]:
+        # the config entries that the files written for the router depend on,
+        # by default all of the json file of the daemon
+        return [f"{self.get_tag()}.json"]
+
     @abstractmethod
     def get_configurer(self) -> DaemonConfigurer:
         pass
@@ -16,7 +32,7 @@ class Daemon(ABC):
 
 class DaemonConfigurer(ABC):
     @abstractmethod
-    def configure(self, router: Router, path: Path, data: Path):
+    def configure(self, router: Router, output: LabOutput, data: Path):
         pass
 
 
@@ -36,3 +52,17 @@ class DaemonParser(ABC):
     @abstractmethod
     def merge(self, topology: Topology):
         pass
+
+    @staticmethod
+    def validate(data: Any, index: Index):
+        # reports with index.error() everything that merge() would choke on,
+        # before anything is generated
+        pass
+
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        # the json split in the entries that the configurers depend on, keyed
+        # like "costs/r1". A changed entry renders again the files that depend
+        # on it and, when its key ends with a router name, that router.
+        # By default the whole file is one entry, that renders every router
+        return {"*": data}
@@ -1,72 +1,101 @@
 from __future__ import annotations
 from pathlib import Path
+from typing import Iterator
 from daemon.classes import Daemon, DaemonConfigurer
 from topology.classes import Router
+from topology.output import LabOutput
 
+REVERSE = "in-addr.arpa"
 
 class DNSConfigurer(DaemonConfigurer):
     def __init__(self, dns: DNSDaemon) -> None:
         self.dns = dns
 
-    def configure(self, router: Router, path: Path, data: Path):
+    def configure(self, router: Router, output: LabOutput, data: Path):
         #
         # Configures resolver for clients and then returns
         #
-        path.joinpath("etc").mkdir(exist_ok=True)
         if router in self.dns.clients_to_resolver:
-            with path.joinpath("etc/resolv.conf").open("w") as f:
-                f.write(
-                    f"nameserver {self.dns.clients_to_resolver[router].router_id}\n"
-                )
+            output.write(
+                f"{router.name}/etc/resolv.conf",
+                f"nameserver {self.dns.clients_to_resolver[router].router_id}\n",
+            )
             return
 
         #
         # Starts named for name servers and resolvers
         #
-        with path.parent.joinpath(f"{router.name}.startup").open("a") as f:
-            f.write("\nsystemctl start named\n")
+        output.append(f"{router.name}.startup", "\nsystemctl start named\n")
 
-        path = path.joinpath("etc/bind")
-        path.mkdir()
+        path = f"{router.name}/etc/bind"
 
         #
         # Configures named.conf.options for name servers and resolvers
         #
-        with path.joinpath("named.conf.options").open("w") as f:
-            f.write('options {\n    directory "/var/cache/bind";\n')
-            if router in self.dns.resolvers:
-                f.write("    allow-recursion { 0/0;};\n    dnssec-validation no;\n")
-            f.write("};")
+        options = 'options {\n    directory "/var/cache/bind";\n'
+        if router in self.dns.resolvers:
+            options += "    allow-recursion { 0/0;};\n    dnssec-validation no;\n"
+        options += "};"
+        output.write(f"{path}/named.conf.options", options)
 
         #
         # Configures named.conf for name servers and resolvers
         #
-        with path.joinpath("named.conf").open("w") as f:
-            f.write('include "/etc/bind/named.conf.options";\n\n')
-
-            f.write('zone "." {\n')
-            f.write(
-                f'    type {"master" if router==self.dns.rootserver else "hint"};\n'
-            )
-            f.write('    file "/etc/bind/db.root";\n};\n\n')
-
-            for zone in self.dns.routers_to_zones[router]:
-                if zone.parent is None:
-                    continue
-                name = zone.get_full_name().removesuffix(".")
-                f.write(
-                    f'zone "{name}" {"{"}\n    type master;\n    file "/etc/bind/db.{name}";\n{"}"};\n\n'
-                )
+        zones = self.dns.get_zones(router)
+        # the full names of the zones come from the trees
+        sources = ["dns.json:root"]
+        if any(is_reverse(zone) for zone in zones):
+            sources.append("dns.json:reverse")
+        with output.depends_on(*sources):
+            output.extend(f"{path}/named.conf", self.iter_named_conf(router, zones))
 
         #
         # Configures dbs for zone authorities and hints for root
         #
-        for zone in self.dns.routers_to_zones[router]:
-            with path.joinpath(
-                f"db.{'root' if zone.parent is None else zone.get_full_name().removesuffix('.')}"
-            ).open("w") as f:
-                out = f"""$TTL 60000
-@    IN    SOA    {"ROOT-SERVER" if zone.parent is None else zone.server.name}.{zone.get_full_name()}    root.{"ROOT-SERVER" if zone.parent is None else zone.server.name}.{zone.get_full_name()} ( 
+        for zone in zones:
+            with output.depends_on(*self.get_zone_sources(zone)):
+                output.write(
+                    f"{path}/db.{zone.file_name}", self.iter_zone_file(router, zone)
+                )
+        if router != self.dns.rootserver:
+            with output.depends_on("dns.json:servers/root"):
+                output.write(
+                    f"{path}/db.root",
+                    f".                   IN  NS    ROOT-SERVER.\nROOT-SERVER.        IN  A     {self.dns.rootserver.router_id}",
+                )
+
+    @staticmethod
+    def get_zone_sources(zone: Zone) -> list[str]:
+        # the servers of the zone and of its children, its names and the tree
+        # of their full names. The reverse zones come from "reverse" and point
+        # to the names of all the zones
+        if is_reverse(zone):
+            return ["dns.json:reverse", "dns.json:names", "dns.json:root"]
+        name = "root" if zone.parent is None else zone.name
+        sources = [f"dns.json:servers/{name}", f"dns.json:names/{name}"]
+        sources.extend(f"dns.json:servers/{child.name}" for child in zone.children)
+        sources.append("dns.json:root")
+        if zone.parent is None:
+            sources.append("dns.json:reverse")
+        return sources
+
+    def iter_named_conf(self, router: Router, zones: list[Zone]) -> Iterator[str]:
+        yield 'include "/etc/bind/named.conf.options";\n\n'
+        yield 'zone "." {\n'
+        yield f'    type {"master" if router==self.dns.rootserver else "hint"};\n'
+        yield '    file "/etc/bind/db.root";\n};\n\n'
+        for zone in zones:
+            if zone.parent is None:
+                continue
+            name = zone.file_name
+            yield f'zone "{name}" {"{"}\n    type master;\n    file "/etc/bind/db.{name}";\n{"}"};\n\n'
+
+    def iter_zone_file(self, router: Router, zone: Zone) -> Iterator[str]:
+        # one chunk for each record, the files of big zones are never built
+        # as a whole string
+        server = zone.server_name
+        yield f"""$TTL 60000
+@    IN    SOA    {server}    root.{server} ( 
     2006031201 ; serial
     28 ; refresh
     14 ; retry
@@ -74,23 +103,24 @@ class DNSConfigurer(DaemonConfigurer):
     0 ; negative cache ttl
     )
     
-@               IN      NS      {"ROOT-SERVER" if zone.parent is None else zone.server.name}.{zone.get_full_name()}
-{"ROOT-SERVER" if zone.parent is None else zone.server.name}.{zone.get_full_name()}    IN      A       {router.router_id}
+@               IN      NS      {server}
+{server}    IN      A       {router.router_id}
 
 """
-                for child in zone.children:
-                    out += f"{child.get_full_name()}            IN      NS      {child.server.name}.{child.get_full_name()}\n"
-                    out += f"{child.server.name}.{child.get_full_name()}        IN      A       {child.server.router_id}\n\n"
+        for child in zone.children:
+            yield f"{child.full_name}            IN      NS      {child.server_name}\n"
+            yield f"{child.server_name}        IN      A       {child.server.router_id}\n\n"
 
-                for router in zone.names:
-                    out += f"{router.name}.{zone.get_full_name()}       IN      A      {router.router_id}\n"
+        suffix = zone.full_name
+        for name in zone.names:
+            yield f"{name.name}.{suffix}       IN      A      {name.router_id}\n"
 
-                f.write(out)
-        if router != self.dns.rootserver:
-            with path.joinpath("db.root").open("w") as f:
-                f.write(
-                    f".                   IN  NS    ROOT-SERVER.\nROOT-SERVER.        IN  A     {self.dns.rootserver.router_id}"
-                )
+        for _, owner, target in zone.pointers:
+            yield f"{owner}       IN      PTR      {target}\n"
+
+
+def is_reverse(zone: Zone) -> bool:
+    return zone.full_name.endswith(f"{REVERSE}.")
 
 
 class DNSDaemon(Daemon):
@@ -98,11 +128,14 @@ class DNSDaemon(Daemon):
         self.routers_to_zones: dict[Router, list[Zone]] = {}
         self.resolvers: set[Router] = set()
         self.clients_to_resolver: dict[Router, Router] = {}
+        self.index = ZoneIndex()
         self.add_root_tree(root)
 
     def add_router(self, router: Router) -> None:
-        self.routers_to_zones[router] = []
-        return super().add_router(router)
+        # a server can have more than one zone, and be a resolver too
+        if router not in self.routers_to_zones:
+            self.routers_to_zones[router] = []
+            super().add_router(router)
 
     def add_resolver(self, router: Router) -> None:
         self.resolvers.add(router)
@@ -117,10 +150,25 @@ class DNSDaemon(Daemon):
         self.add_zone_tree(root)
 
     def add_zone_tree(self, zone: Zone):
-        self.add_router(zone.server)
-        self.routers_to_zones[zone.server].append(zone)
-        for child in zone.children:
-            self.add_zone_tree(child)
+        # iterative, the zone trees of big labs can be deep
+        pending = [zone]
+        while pending:
+            zone = pending.pop()
+            self.add_router(zone.server)
+            self.routers_to_zones[zone.server].append(zone)
+            self.index.add(zone)
+            pending.extend(reversed(zone.children))
+
+    def get_zones(self, router: Router) -> list[Zone]:
+        return self.routers_to_zones.get(router, [])
+
+    def get_sources(self, router: Router) -> list[str]:
+        # what the router serves and resolves, the files add their zones
+        return [
+            f"dns.json:hosts/{router.name}",
+            f"dns.json:resolvers/{router.name}",
+            f"dns.json:clients/{router.name}",
+        ]
 
     def get_configurer(self) -> DaemonConfigurer:
         return DNSConfigurer(self)
@@ -135,19 +183,64 @@ class Zone:
         names:list[Router]
     ) -> None:
         self.name = name
-        self.names: set[Router] = set(names)
+        # ordered, so that zone files are the same on every run
+        self.names: dict[Router, None] = dict.fromkeys(names)
         self.parent = parent
         self.server = server
         self.children: list[Zone] = []
+        # the PTR records of reverse zones: the router, its address, its name
+        self.pointers: list[tuple[Router, str, str]] = []
+        # the names are computed once, the parent never changes
+        if parent is not None:
+            self.full_name = f"{name}.{parent.full_name}"
+            self.server_name = f"{server.name}.{self.full_name}"
+            self.file_name = self.full_name.removesuffix(".")
+        else:
+            self.full_name = name
+            self.server_name = f"ROOT-SERVER.{name}"
+            self.file_name = "root"
 
     def add_child(self, zone: Zone):
         self.children.append(zone)
 
     def add_name(self, router: Router):
-        self.names.add(router)
+        self.names[router] = None
+
+    def add_pointer(self, router: Router, owner: str, target: str):
+        self.pointers.append((router, owner, target))
 
     def get_full_name(self) -> str:
-        if self.parent is not None:
-            return self.name + "." + self.parent.get_full_name()
-        else:
-            return self.name
+        return self.full_name
+
+
+class ZoneIndex:
+    # Trie of the zones by label, from the top level domain down, to find the
+    # zones of a name without looking at all of them
+    def __init__(self) -> None:
+        self.children: dict[str, ZoneIndex] = {}
+        self.zone: Zone | None = None
+
+    @staticmethod
+    def get_labels(fqdn: str) -> list[str]:
+        labels = [label for label in fqdn.lower().split(".") if label]
+        labels.reverse()
+        return labels
+
+    def add(self, zone: Zone):
+        node = self
+        for label in self.get_labels(zone.full_name):
+            node = node.children.setdefault(label, ZoneIndex())
+        node.zone = zone
+
+    def get_path(self, fqdn: str) -> list[Zone]:
+        # the zones that delegate the name, from the root down to its own
+        node = self
+        path = [] if self.zone is None else [self.zone]
+        for label in self.get_labels(fqdn):
+            child = node.children.get(label)
+            if child is None:
+                break
+            node = child
+            if node.zone is not None:
+                path.append(node.zone)
+        return path
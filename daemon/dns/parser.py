@@ -3,8 +3,10 @@ import json
 from pathlib import Path
 from typing import Any
 from daemon.classes import DaemonParser
-from daemon.dns.classes import DNSDaemon, Zone
+from daemon.dns.classes import REVERSE, DNSDaemon, Zone
+from topology.address import get_mask, parse_prefix
 from topology.classes import Router, Topology
+from topology.validate import Index
 
 
 class DNSParser(DaemonParser):
@@ -16,6 +18,69 @@ class DNSParser(DaemonParser):
     def get_name() -> str:
         return "dns"
 
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        # the zones by the router that serves them and the clients by resolver,
+        # and the other way around so that the routers named there are rendered
+        entries: dict[str, Any] = {"root": data["root"], "reverse": get_reverse(data)}
+        hosts: dict[str, list[str]] = defaultdict(list)
+        for line in data["servers"]:
+            zone, server = line.split()
+            entries[f"servers/{zone}"] = server
+            hosts[server].append(zone)
+        for prefix, server in get_reverse(data).items():
+            hosts[server].append(prefix)
+        entries.update((f"hosts/{server}", zones) for server, zones in hosts.items())
+        names: dict[str, list[str]] = defaultdict(list)
+        for line in data.get("names", []):
+            router, zone = line.split()
+            names[zone].append(router)
+        entries.update((f"names/{zone}", routers) for zone, routers in names.items())
+        for line in data.get("resolvers", []):
+            resolver, *clients = line.split()
+            entries[f"resolvers/{resolver}"] = clients
+            entries.update((f"clients/{client}", resolver) for client in clients)
+        return entries
+
+    @staticmethod
+    def validate(data: Any, index: Index):
+        servers: dict[str, str] = {}
+        for line in data["servers"]:
+            zone, server = line.split()
+            index.check_routers(f"dns.json: servers {zone}", [server])
+            servers[zone] = server
+
+        # every zone of the tree needs a server
+        zones = ["root"]
+        pending: list[Any] = [data["root"]]
+        while pending:
+            tree = pending.pop()
+            zones.extend(tree)
+            if isinstance(tree, dict):
+                pending.extend(tree.values())
+        for zone in zones:
+            if zone not in servers:
+                index.error(f"dns.json: the zone {zone} has no server")
+
+        known = set(zones)
+        for line in data.get("names", []):
+            router, zone = line.split()
+            index.check_routers("dns.json: names", [router])
+            if zone not in known:
+                index.error(f"dns.json: names: the zone {zone} does not exist")
+        for line in data.get("resolvers", []):
+            index.check_routers("dns.json: resolvers", line.split())
+        for prefix, server in get_reverse(data).items():
+            where = f"dns.json: reverse {prefix}"
+            index.check_routers(where, [server])
+            try:
+                ip, prefixlen = parse_prefix(prefix)
+            except ValueError:
+                index.error(f"{where}: invalid prefix")
+                continue
+            if prefixlen % 8 or ip & ~get_mask(prefixlen):
+                index.error(f"{where}: reverse zones need a /0, /8, /16 or /24 network")
+
     def zone_tree(
         self,
         parent: Zone,
@@ -37,6 +102,48 @@ class DNSParser(DaemonParser):
                     current, zone_name_to_server, zone_name_to_name, data[zone]
                 )
 
+    def reverse_tree(self, root: Zone, reverse: dict[str, str], topology: Topology):
+        # A zone for each prefix of "reverse", delegated by the closest of the
+        # others that contains it (or by the root). Every address goes to the
+        # zone of its longest prefix, with a lookup for each octet
+        name_to_router = topology.get_router_map()
+        zones: dict[tuple[int, int], Zone] = {}
+        for ip, prefixlen, server in sorted(
+            (*parse_prefix(prefix), server) for prefix, server in reverse.items()
+        ):
+            parent, parent_length = root, 0
+            for length in range(prefixlen - 8, -1, -8):
+                key = (ip & get_mask(length), length)
+                if key in zones:
+                    parent, parent_length = zones[key], length
+                    break
+            octets = get_octets(ip)[parent_length // 8 : prefixlen // 8]
+            labels = [str(octet) for octet in reversed(octets)]
+            if parent is root:
+                labels.append(REVERSE)
+            zone = Zone(".".join(labels), parent, name_to_router[server], [])
+            parent.add_child(zone)
+            zones[ip, prefixlen] = zone
+
+        # the PTR records point to the names of the routers, when they have one
+        forward: dict[Router, str] = {}
+        pending = [root]
+        while pending:
+            zone = pending.pop()
+            for router in zone.names:
+                forward.setdefault(router, f"{router.name}.{zone.full_name}")
+            pending.extend(zone.children)
+
+        for router in topology.routers:
+            target = forward.get(router, f"{router.name}.")
+            for interface in router.interfaces.values():
+                for length in (24, 16, 8, 0):
+                    zone = zones.get((interface.ip & get_mask(length), length))
+                    if zone is not None:
+                        owner = ".".join(map(str, reversed(get_octets(interface.ip))))
+                        zone.add_pointer(router, f"{owner}.{REVERSE}.", target)
+                        break
+
     def merge(self, topology: Topology):
         server_lines: list[str] = self.data["servers"]
         name_to_router = topology.get_router_map()
@@ -58,6 +165,10 @@ class DNSParser(DaemonParser):
         root = Zone("", None, zone_name_to_server["root"], zone_name_to_name["root"])
         self.zone_tree(root, zone_name_to_server, zone_name_to_name, self.data["root"])
 
+        reverse = get_reverse(self.data)
+        if reverse:
+            self.reverse_tree(root, reverse, topology)
+
         dns = DNSDaemon(root)
 
         if "resolvers" in self.data:
@@ -80,3 +191,15 @@ class DNSParser(DaemonParser):
                             f"the router specified as client does not exist"
                         )
                     dns.add_client(client, resolver)
+
+
+def get_reverse(data: Any) -> dict[str, str]:
+    # "reverse": {"<prefix>": "<server>"}, or just the server of in-addr.arpa
+    reverse = data.get("reverse", {})
+    if isinstance(reverse, str):
+        return {"0.0.0.0/0": reverse}
+    return reverse
+
+
+def get_octets(ip: int) -> list[int]:
+    return [(ip >> shift) & 255 for shift in (24, 16, 8, 0)]
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import Callable
+from daemon.dns.classes import DNSDaemon, Zone
+from topology.address import format_ip
+from topology.classes import Router
+
+# whether a router can query an address and get the answer back
+Reaches = Callable[[Router, int], bool]
+
+
+class Resolution:
+    __slots__ = ("answer", "error", "depth")
+
+    def __init__(self, answer: str | None, error: str | None, depth: int) -> None:
+        self.answer = answer
+        self.error = error
+        # referrals followed from the root to the zone of the name
+        self.depth = depth
+
+
+class DNSReport:
+    def __init__(self) -> None:
+        self.results: dict[Router, dict[str, Resolution]] = {}
+        self.errors: list[str] = []
+
+    def is_ok(self) -> bool:
+        return not self.errors and all(
+            result.error is None
+            for results in self.results.values()
+            for result in results.values()
+        )
+
+    def get_summary(self, limit: int = 8) -> str:
+        lines = list(self.errors)
+        total = failed = 0
+        for resolver, results in self.results.items():
+            failures = [
+                f"{resolver.name}: {name} {result.error}"
+                for name, result in results.items()
+                if result.error is not None
+            ]
+            lines.extend(failures[:limit])
+            if len(failures) > limit:
+                lines.append(f"{resolver.name}: and {len(failures) - limit} more")
+            depths = [r.depth for r in results.values() if r.error is None]
+            if depths:
+                deepest = max(results, key=lambda name: results[name].depth)
+                lines.append(
+                    f"{resolver.name} resolves {len(depths)}/{len(results)} names,"
+                    f" {sum(depths) / len(depths):.1f} referrals on average,"
+                    f" {results[deepest].depth} for {deepest}"
+                )
+            total += len(results)
+            failed += len(failures)
+        lines.append(f"{total - failed}/{total} lookups work")
+        return "\n".join(lines)
+
+
+class DNSSimulator:
+    # Resolves names like a recursive resolver that starts from the root
+    # hints: each zone refers it to the child zone on the way to the name, and
+    # the zone of the name answers. The referrals from a resolver to a zone
+    # are the same for all the names of the zone, so they are cached and each
+    # name costs a walk in the zone index and a lookup in its zone.
+    def __init__(self, dns: DNSDaemon, reaches: Reaches | None = None) -> None:
+        self.dns = dns
+        self.reaches = reaches
+        self.referrals: dict[tuple[Router, Zone], tuple[str | None, int]] = {}
+        self.records: dict[Zone, dict[str, str | None]] = {}
+        for zone in self.get_zones():
+            records: dict[str, str | None] = {}
+            for router in zone.names:
+                address = router.router_ip
+                name = f"{router.name}.{zone.full_name}".lower()
+                records[name] = None if address is None else format_ip(address)
+            for _, owner, target in zone.pointers:
+                records[owner.lower()] = target
+            self.records[zone] = records
+
+    def get_zones(self) -> list[Zone]:
+        zones: dict[Zone, None] = {}
+        for owned in self.dns.routers_to_zones.values():
+            zones.update(dict.fromkeys(owned))
+        return list(zones)
+
+    def get_names(self) -> list[str]:
+        return [name for records in self.records.values() for name in records]
+
+    def can_query(self, resolver: Router, server: Router) -> str | None:
+        # why the server can't be asked, if it can't
+        if server.router_ip is None:
+            return f"{server.name} has no address"
+        if self.reaches is not None and not self.reaches(resolver, server.router_ip):
+            return f"{server.name} ({server.router_id}) is unreachable"
+        return None
+
+    def reach_zone(self, resolver: Router, zone: Zone) -> tuple[str | None, int]:
+        # the zones above that aren't cached yet are resolved from the top
+        chain: list[Zone] = []
+        current: Zone | None = zone
+        while current is not None and (resolver, current) not in self.referrals:
+            chain.append(current)
+            current = current.parent
+        for current in reversed(chain):
+            if current.parent is None:
+                result = (self.can_query(resolver, current.server), 0)
+            else:
+                error, depth = self.referrals[resolver, current.parent]
+                if error is None:
+                    error = self.can_query(resolver, current.server)
+                result = (error, depth + 1)
+            self.referrals[resolver, current] = result
+        return self.referrals[resolver, zone]
+
+    def resolve(self, resolver: Router, fqdn: str) -> Resolution:
+        path = self.dns.index.get_path(fqdn)
+        if not path:
+            return Resolution(None, "has no root zone", 0)
+        zone = path[-1]
+        error, depth = self.reach_zone(resolver, zone)
+        if error is not None:
+            return Resolution(None, f"can't be resolved, {error}", depth)
+        records = self.records[zone]
+        name = fqdn.lower()
+        if name not in records:
+            # like a name whose zone was delegated to a child zone
+            return Resolution(None, f"is not in zone {zone.file_name}", depth)
+        answer = records[name]
+        if answer is None:
+            return Resolution(None, "has no address", depth)
+        return Resolution(answer, None, depth)
+
+    def run(self) -> DNSReport:
+        report = DNSReport()
+        for client, resolver in self.dns.clients_to_resolver.items():
+            error = self.can_query(client, resolver)
+            if error is not None:
+                report.errors.append(f"{client.name} can't use its resolver, {error}")
+        names = self.get_names()
+        for resolver in sorted(self.dns.resolvers, key=lambda router: router.name):
+            report.results[resolver] = {
+                name: self.resolve(resolver, name) for name in names
+            }
+        return report
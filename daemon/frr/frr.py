@@ -1,11 +1,16 @@
 from __future__ import annotations
 from abc import abstractmethod
 from collections import defaultdict
+from heapq import heappop, heappush
+from itertools import count
 from pathlib import Path
 from daemon.classes import Daemon, DaemonConfigurer, DaemonParser
 from topology.classes import Router, Topology
-from shutil import copytree
 from topology.classes import Interface, Lan, Router
+from topology import stats
+from topology.address import format_ip, summarize
+from topology.output import LabOutput, get_template_cache
+from topology.validate import Index
 from typing import Any
 import json
 
@@ -14,38 +19,86 @@ class FRRConfigurer(DaemonConfigurer):
     def __init__(self, daemon: FRR) -> None:
         self.daemon = daemon
 
-    def configure(self, router: Router, path: Path, data: Path):
-        # enables frr on that computer
-        with path.parent.joinpath(router.name + ".startup").open("a") as f:
-            f.write("\nsystemctl start frr\n")
-        # copies /etc/frr in that computer's root
-        path.joinpath("etc").mkdir(exist_ok=True)
-        copytree(data.joinpath("frr"), path.joinpath("etc/frr"))
+    def configure(self, router: Router, output: LabOutput, data: Path):
+        daemons = self.daemon.router_to_daemons[router]
+        if any(daemon.uses_frr() for daemon in daemons):
+            # enables frr on that computer
+            output.append(f"{router.name}.startup", "\nsystemctl start frr\n")
+            # copies /etc/frr in that computer's root
+            template = self.daemon.templates.get(data.joinpath("frr"))
+            output.add_template(template, f"{router.name}/etc/frr")
         # configures all required daemons
-        for daemon in self.daemon.router_to_daemons[router]:
-            daemon.get_configurer().configure(router, path, data)
+        for daemon in daemons:
+            configurer = daemon.get_configurer()
+            with stats.timer("configurer", type(configurer).__name__):
+                configurer.configure(router, output, data)
+        # one bfd session for each neighbor, whatever daemons asked for it
+        peers: dict[Interface, None] = {}
+        for daemon in daemons:
+            peers.update(dict.fromkeys(daemon.get_bfd_peers(router)))
+        if peers:
+            local = {iface.lan: iface for iface in router.interfaces.values()}
+            lines = ["bfd\n"]
+            for peer in peers:
+                lines.append(f"peer {peer.address} interface {local[peer.lan].name}\n")
+            lines.append("\n")
+            path = f"{router.name}/etc/frr"
+            output.extend(f"{path}/frr.conf", lines)
+            output.append(f"{path}/daemons", "\nbfdd=yes")
 
 
 class FRR(Daemon):
-    def __init__(self, config: Path, topology: Topology) -> None:
+    def __init__(
+        self,
+        config: Path,
+        topology: Topology,
+        parsers: list[type[FRRParser]] | None = None,
+    ) -> None:
         self.configurer: FRRConfigurer = FRRConfigurer(self)
-        self.router_to_daemons: dict[Router, list[Daemon]] = defaultdict(list)
-        self.configure_daemons(config, topology)
+        self.router_to_daemons: dict[Router, list[FRRDaemon]] = defaultdict(list)
+        self.daemons: dict[str, FRRDaemon] = {}
+        # data/frr is read once for all the routers
+        self.templates = get_template_cache()
+        self.configure_daemons(config, topology, parsers or list(PARSERS))
 
     def get_configurer(self) -> DaemonConfigurer:
         return self.configurer
 
-    def add_daemon_to_router(self, daemon: Daemon, router: Router):
+    def add_daemon_to_router(self, daemon: FRRDaemon, router: Router):
         if router not in self.router_to_daemons:
             self.add_router(router)
         self.router_to_daemons[router].append(daemon)
 
-    def configure_daemons(self, config: Path, topology: Topology):
-        for daemon in (OSPFParser, RIPParser, BGPParser):
+    def replace_daemons(self, daemon: FRRDaemon, router: Router):
+        if router not in self.router_to_daemons:
+            self.add_router(router)
+        # the router leaves the other daemons, so nobody peers with it anymore
+        for other in self.router_to_daemons[router]:
+            other.remove_router(router)
+        self.router_to_daemons[router] = [daemon]
+
+    def get_daemon(self, name: str) -> FRRDaemon | None:
+        return self.daemons.get(name)
+
+    def get_sources(self, router: Router) -> list[str]:
+        # the daemons of the router and of its neighbors, that it has sessions
+        # with: the rest is recorded by the configurers of the daemons
+        names = [router.name] + [n.router.name for n in router.get_neighbors()]
+        return [
+            f"{parser.get_name()}.json:routers/{name}"
+            for parser in PARSERS
+            for name in names
+        ]
+
+    def configure_daemons(
+        self, config: Path, topology: Topology, parsers: list[type[FRRParser]]
+    ):
+        for daemon in parsers:
             conf_path = config.joinpath(f"{daemon.get_name()}.json")
             if conf_path.exists():
                 parser = daemon(conf_path, self)
                 parser.merge(topology)
+                self.daemons[daemon.get_name()] = parser.get_daemon()
 
 
 class FRRDaemon(Daemon):
@@ -55,6 +108,18 @@ class FRRDaemon(Daemon):
     def add_router(self, router: Router) -> None:
         self.frr.add_daemon_to_router(self, router)
 
+    def uses_frr(self) -> bool:
+        # whether the router needs to start frr for this daemon
+        return True
+
+    def get_bfd_peers(self, router: Router) -> list[Interface]:
+        # the neighbors that the router checks with bfd for this daemon
+        return []
+
+    def remove_router(self, router: Router) -> None:
+        # called when the daemons of the router are replaced
+        pass
+
 
 class FRRParser(DaemonParser):
     def __init__(self, path: Path, frr: FRR) -> None:
@@ -62,12 +127,12 @@ class FRRParser(DaemonParser):
         self.daemon = self.init_daemon()
         super().__init__(path)
 
-    def init_daemon(self) -> Daemon:
+    def init_daemon(self) -> FRRDaemon:
         daemon: FRRDaemon = self.get_daemon_type()()  # type:ignore
         daemon.setFRR(self.frr)
         return daemon
 
-    def get_daemon(self) -> Daemon:
+    def get_daemon(self) -> FRRDaemon:
         return self.daemon
 
     @abstractmethod
@@ -75,6 +140,67 @@ class FRRParser(DaemonParser):
         pass
 
 
+class Profile:
+    # Timers for how fast the routers notice a change and agree again, the
+    # frr defaults are used without a profile. Seconds, the spf ones are ms
+    def __init__(
+        self,
+        hello: int,
+        dead: int,
+        spf: tuple[int, int, int],
+        keepalive: int,
+        hold: int,
+        advertisement: int,
+        bfd: bool,
+    ) -> None:
+        self.hello = hello
+        self.dead = dead
+        self.spf = spf
+        self.keepalive = keepalive
+        self.hold = hold
+        self.advertisement = advertisement
+        self.bfd = bfd
+
+
+PROFILES: dict[str, Profile] = {
+    "fast": Profile(
+        hello=1,
+        dead=3,
+        spf=(0, 50, 500),
+        keepalive=3,
+        hold=9,
+        advertisement=0,
+        bfd=True,
+    ),
+}
+
+
+def get_profile(data: Any) -> Profile | None:
+    name = data.get("profile") if data is not None else None
+    return None if name is None else PROFILES[name]
+
+
+def validate_profile(file: str, data: Any, index: Index):
+    name = data.get("profile")
+    if name is not None and name not in PROFILES:
+        index.error(f"{file}: unknown profile {name}, try {' '.join(PROFILES)}")
+
+
+def get_members(routers: list[str]) -> dict[str, Any]:
+    # the routers of a daemon are entries, so adding or removing one renders it
+    return {f"routers/{router}": True for router in routers}
+
+
+def validate_costs(file: str, costs: list[str], index: Index):
+    # lines that look like "<router> <interface> <cost>"
+    for line in costs:
+        words = line.split()
+        if len(words) != 3 or not words[2].isdigit():
+            index.error(f"{file}: cost '{line}' should be '<router> <interface> <n>'")
+        else:
+            index.check_interface(f"{file}: costs", words[0], words[1])
+
+
 class RIPParser(FRRParser):
     def load(self, path: Path) -> Any:
         with path.open("r") as l:
@@ -85,49 +211,200 @@ class RIPParser(FRRParser):
 
         parsed_routers = topology.get_router_map()
 
-        result = self.get_daemon()
+        result = self.get_rip()
 
         for router in routers:
             result.add_router(parsed_routers[router])
 
+        if "timers" in self.data:
+            result.timers = [int(value) for value in self.data["timers"]]
+
     @staticmethod
     def get_name() -> str:
         return "rip"
 
+    @staticmethod
+    def validate(data: Any, index: Index):
+        index.check_routers("rip.json: routers", data["routers"])
+        timers = data.get("timers")
+        if timers is not None and (
+            len(timers) != 3 or not all(str(value).isdigit() for value in timers)
+        ):
+            index.error("rip.json: timers should be [<update> <timeout> <garbage>]")
+
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        entries: dict[str, Any] = get_members(data["routers"])
+        entries["timers"] = data.get("timers")
+        return entries
+
     def get_daemon_type(self) -> type[Daemon]:
         return RIP
 
+    def get_rip(self) -> RIP:
+        daemon = self.get_daemon()
+        assert isinstance(daemon, RIP)
+        return daemon
+
 
 class RIPConfigurer(DaemonConfigurer):
     def __init__(self, daemon: RIP) -> None:
         self.daemon = daemon
 
-    def configure(self, router: Router, path: Path, data: Path):
+    def configure(self, router: Router, output: LabOutput, data: Path):
         lines: list[str] = []
 
         lines.append("router rip\n")
         for lan in router.get_lans():
             lines.append(f"network {lan.full_address}\n")
+        # nobody on the other side would listen to the updates
+        for interface in router.interfaces.values():
+            if not self.daemon.has_peers(interface):
+                lines.append(f"passive-interface {interface.name}\n")
+        if self.daemon.timers is not None:
+            lines.append("timers basic {} {} {}\n".format(*self.daemon.timers))
         lines.append("redistribute connected\n\n")
         lines.append("redistribute bgp\n\n")
 
-        path = path.joinpath("etc/frr/")
+        path = f"{router.name}/etc/frr"
+        with output.depends_on("rip.json:timers"):
+            output.extend(f"{path}/frr.conf", lines)
+            output.append(f"{path}/daemons", "\nripd=yes")
 
-        with path.joinpath("frr.conf").open("a") as f:
-            f.writelines(lines)
 
-        with path.joinpath("daemons").open("a") as f:
-            f.write("\nripd=yes")
+# RIP counts to 15, a metric of 16 is unreachable
+RIP_INFINITY = 16
 
 
 class RIP(FRRDaemon):
     def __init__(self) -> None:
         super().__init__()
         self.configurer = RIPConfigurer(self)
+        # ordered, so that the warnings are the same on every run
+        self.routers: dict[Router, None] = {}
+        self.timers: list[int] | None = None
+        # built on the first search after the routers change
+        self.peers: dict[Router, list[Router]] | None = None
+        self.ranges: dict[Router, list[Router]] | None = None
+        self.far: list[Router] = []
+
+    def add_router(self, router: Router) -> None:
+        self.routers[router] = None
+        self.peers = self.ranges = None
+        super().add_router(router)
+
+    def remove_router(self, router: Router) -> None:
+        self.routers.pop(router, None)
+        self.peers = self.ranges = None
 
     def get_configurer(self) -> DaemonConfigurer:
         return self.configurer
 
+    def has_peers(self, interface: Interface) -> bool:
+        return any(
+            other.router in self.routers
+            for other in interface.lan.interfaces
+            if other.router is not interface.router
+        )
+
+    def get_peers(self, router: Router) -> list[Router]:
+        if self.peers is None:
+            self.peers = {
+                member: [
+                    neighbor.router
+                    for neighbor in member.get_neighbors()
+                    if neighbor.router in self.routers
+                ]
+                for member in self.routers
+            }
+        return self.peers[router]
+
+    def get_distances(self, source: Router, limit: int | None = None):
+        # hops from the source to the other routers of its domain (bfs)
+        distances = {source: 0}
+        frontier = [source]
+        hops = 0
+        while frontier and (limit is None or hops < limit):
+            hops += 1
+            following: list[Router] = []
+            for router in frontier:
+                for peer in self.get_peers(router):
+                    if peer not in distances:
+                        distances[peer] = hops
+                        following.append(peer)
+            frontier = following
+        return distances
+
+    def get_ranges(self) -> dict[Router, list[Router]]:
+        # The routers whose lans reach each router before RIP counts to
+        # infinity, for the routers that don't get the lans of their whole
+        # domain: a route to a lan costs one more than the routers in between.
+        # Shared by the diameter check and the simulator
+        if self.ranges is not None:
+            return self.ranges
+        self.ranges = {}
+        self.far = []
+        seen: set[Router] = set()
+        for start in self.routers:
+            if start in seen:
+                continue
+            domain = self.get_distances(start)
+            seen.update(domain)
+            if self.is_close(domain):
+                continue
+            far: Router | None = None
+            for router in domain:
+                near = self.get_distances(router, RIP_INFINITY - 2)
+                if len(near) < len(domain):
+                    self.ranges[router] = list(near)
+                    far = far or router
+            # the first router of the domain with others too far from it
+            if far is not None:
+                self.far.append(far)
+        return self.ranges
+
+    def is_close(self, domain: dict[Router, int]) -> bool:
+        # Whether no two routers of the domain are 15 hops apart. Two routers
+        # that are i and j hops away from a center are at most i + j apart, so
+        # only the farthest ones from the center are searched, until the
+        # others are too close to each other to matter (ifub)
+        limit = RIP_INFINITY - 1
+        if len(domain) < limit:
+            return True
+        # the middle of the longest path found is a good center
+        end = max(domain, key=domain.__getitem__)
+        far = self.get_distances(end)
+        other = max(far, key=far.__getitem__)
+        if far[other] >= limit:
+            return False
+        back = self.get_distances(other)
+        half = far[other] // 2
+        center = next(r for r in far if far[r] == half and back[r] == far[other] - half)
+        levels: dict[int, list[Router]] = defaultdict(list)
+        for router, hops in self.get_distances(center).items():
+            levels[hops].append(router)
+        depth = max(levels)
+        while 2 * depth >= limit:
+            for router in levels[depth]:
+                if max(self.get_distances(router, limit).values()) >= limit:
+                    return False
+            depth -= 1
+        return True
+
+    def check_diameter(self) -> list[str]:
+        # two routers that are 15 hops apart can't reach each other's lans
+        warnings: list[str] = []
+        self.get_ranges()
+        for router in self.far:
+            distances = self.get_distances(router)
+            other = max(distances, key=distances.__getitem__)
+            hops = distances[other]
+            warnings.append(
+                f"RIP: {router.name} and {other.name} are {hops} hops apart,"
+                f" their lans are too far for RIP ({RIP_INFINITY} is unreachable)"
+            )
+        return warnings
+
 
 class OSPFParser(FRRParser):
     def load(self, path: Path) -> Any:
@@ -159,6 +436,10 @@ class OSPFParser(FRRParser):
         for router in routers:
             result.add_router(parsed_routers[router])
 
+        if self.data.get("summarize", False):
+            result.summarize_areas()
+        result.profile = get_profile(self.data)
+
         costs: list[str] = self.data["costs"]
         for cost in costs:
             router, interface, value = cost.split()
@@ -170,6 +451,38 @@ class OSPFParser(FRRParser):
     def get_name() -> str:
         return "ospf"
 
+    @staticmethod
+    def validate(data: Any, index: Index):
+        areas: dict[str, str] = {}
+        for key in ("stubs", "backbones"):
+            for name, lans in data["areas"].get(key, {}).items():
+                where = f"ospf.json: area {name}"
+                for lan in lans.split():
+                    if not index.has_lan(lan):
+                        index.error(f"{where}: the lan {lan} does not exist")
+                    elif lan in areas:
+                        index.error(f"{where}: the lan {lan} is also in {areas[lan]}")
+                    else:
+                        areas[lan] = name
+        index.check_routers("ospf.json: routers", data["routers"])
+        validate_costs("ospf.json", data["costs"], index)
+        validate_profile("ospf.json", data, index)
+
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        entries: dict[str, Any] = get_members(data["routers"])
+        costs: dict[str, list[str]] = defaultdict(list)
+        for line in data["costs"]:
+            costs[line.split()[0]].append(line)
+        entries.update((f"costs/{router}", lines) for router, lines in costs.items())
+        for key, is_stub in (("stubs", True), ("backbones", False)):
+            for name, lans in data["areas"].get(key, {}).items():
+                for lan in lans.split():
+                    entries[f"areas/{lan}"] = [name, is_stub]
+        entries["summarize"] = data.get("summarize", False)
+        entries["profile"] = data.get("profile")
+        return entries
+
     def get_daemon_type(self) -> type[Daemon]:
         return OSPF
 
@@ -181,29 +494,56 @@ class OSPFConfigurer(DaemonConfigurer):
     def __init__(self, daemon: OSPF) -> None:
         self.daemon: OSPF = daemon
 
-    def configure(self, router: Router, path: Path, data: Path):
-        lines: list[str] = []
+    def configure(self, router: Router, output: LabOutput, data: Path):
+        interfaces: dict[str, list[str]] = {}
         for cost in self.daemon.costs[router]:
-            lines.append(f"interface {cost.interface.name}\n")
-            lines.append(f"ospf cost {cost.value}\n\n")
+            interfaces.setdefault(cost.interface.name, []).append(
+                f"ospf cost {cost.value}\n"
+            )
+        profile = self.daemon.profile
+        if profile is not None:
+            for interface in router.interfaces.values():
+                if interface.lan in self.daemon.lans:
+                    timers = interfaces.setdefault(interface.name, [])
+                    timers.append(f"ip ospf hello-interval {profile.hello}\n")
+                    timers.append(f"ip ospf dead-interval {profile.dead}\n")
+                    if profile.bfd:
+                        timers.append("ip ospf bfd\n")
+        lines: list[str] = []
+        for name, settings in interfaces.items():
+            lines.append(f"interface {name}\n")
+            lines.extend(settings)
+            lines.append("\n")
 
         lines.append("router ospf\n")
+        if profile is not None:
+            lines.append("timers throttle spf {} {} {}\n".format(*profile.spf))
+        areas: dict[Area, None] = {}
         for lan in router.get_lans():
             if lan in self.daemon.lans:
                 area = self.daemon.lans[lan]
+                areas[area] = None
                 lines.append(f"network {lan.full_address} area {area.name}\n")
                 if area.is_stub:
                     lines.append(f"area {area.name} stub\n")
+        # area border routers summarize the areas they are attached to
+        if len(areas) > 1:
+            for area in areas:
+                if area.name != BACKBONE:
+                    for prefix in area.ranges:
+                        lines.append(f"area {area.name} range {prefix}\n")
         lines.append("redistribute connected\n\n")
         lines.append("redistribute bgp\n\n")
 
-        path = path.joinpath("etc/frr/")
-
-        with path.joinpath("frr.conf").open("a") as f:
-            f.writelines(lines)
-
-        with path.joinpath("daemons").open("a") as f:
-            f.write("\nospfd=yes")
+        sources = [f"ospf.json:costs/{router.name}", "ospf.json:profile"]
+        sources.extend(f"ospf.json:areas/{lan.name}" for lan in router.get_lans())
+        # the ranges of a border router come from all the lans of its areas
+        if len(areas) > 1:
+            sources.extend(["ospf.json:areas", "ospf.json:summarize"])
+        path = f"{router.name}/etc/frr"
+        with output.depends_on(*sources):
+            output.extend(f"{path}/frr.conf", lines)
+            output.append(f"{path}/daemons", "\nospfd=yes")
 
 
 class OSPF(FRRDaemon):
@@ -212,6 +552,7 @@ class OSPF(FRRDaemon):
         self.configurer: OSPFConfigurer = OSPFConfigurer(self)
         self.lans: dict[Lan, Area] = {}
         self.costs: dict[Router, list[Cost]] = {}
+        self.profile: Profile | None = None
 
     def add_area(self, area: Area):
         for lan in area.lans:
@@ -221,22 +562,56 @@ class OSPF(FRRDaemon):
         self.costs[router] = []
         return super().add_router(router)
 
+    def remove_router(self, router: Router) -> None:
+        self.costs.pop(router, None)
+
     def add_cost(self, router: Router, cost: Cost):
         self.costs[router].append(cost)
 
+    def summarize_areas(self):
+        areas: dict[Area, None] = dict.fromkeys(self.lans.values())
+        for area in areas:
+            area.summarize()
+
+    def get_bfd_peers(self, router: Router) -> list[Interface]:
+        # the ospf neighbors on the lans of the areas
+        if self.profile is None or not self.profile.bfd:
+            return []
+        return [
+            neighbor
+            for neighbor in router.get_neighbors()
+            if neighbor.lan in self.lans and neighbor.router in self.costs
+        ]
+
     def get_configurer(self) -> DaemonConfigurer:
         return self.configurer
 
 
+BACKBONE = "0.0.0.0"
+
+
 class Area:
     def __init__(self, name: str, is_stub: bool) -> None:
         self.name = name
         self.is_stub = is_stub
         self.lans: list[Lan] = []
+        self.ranges: list[str] = []
 
     def add_lan(self, lan: Lan):
         self.lans.append(lan)
 
+    def summarize(self):
+        # only the aggregates of two or more lans are worth a range
+        aggregates = summarize((lan.network, lan.prefixlen) for lan in self.lans)
+        covered: dict[tuple[int, int], int] = defaultdict(int)
+        for aggregate in aggregates.values():
+            covered[aggregate] += 1
+        self.ranges = [
+            f"{format_ip(network)}/{prefixlen}"
+            for (network, prefixlen), count in sorted(covered.items())
+            if count > 1
+        ]
+
 
 class Cost:
     def __init__(self, interface: Interface, value: str) -> None:
@@ -251,15 +626,140 @@ class BGP(FRRDaemon):  # Stores the bgp data
         # Init bgp specific data structures
         self.router_to_as: dict[Router, str] = {}
         self.as_to_router: dict[str, list[Router]] = defaultdict(list)
+        # route reflection, for the ASes that don't use a full mesh
+        self.clusters: dict[str, list[Cluster]] = defaultdict(list)
+        self.router_to_cluster: dict[Router, Cluster] = {}
+        self.reflectors: dict[str, set[Router]] = defaultdict(set)
+        # aggregate announced in place of each lan, when summarizing
+        self.aggregates: dict[str, dict[Lan, str]] = {}
+        self.profile: Profile | None = None
+        # the ibgp peers in the order of their AS, built on first use: the
+        # routers meshed together in each AS with clusters, and for each
+        # cluster its reflectors and the peers of its reflectors
+        self.meshed: dict[str, list[Router]] | None = None
+        self.sessions: dict[Cluster, tuple[list[Router], list[Router]]] = {}
 
     def get_configurer(self) -> DaemonConfigurer:
         return self.configurer
 
+    def get_bfd_peers(self, router: Router) -> list[Interface]:
+        # the bgp neighbors on the lans of the router, both ibgp and ebgp
+        if self.profile is None or not self.profile.bfd:
+            return []
+        return [
+            neighbor
+            for neighbor in router.get_neighbors()
+            if neighbor.router in self.router_to_as
+        ]
+
     def add_as_router(self, as_name: str, router: Router) -> None:
+        self.meshed = None
         self.router_to_as[router] = as_name
         self.as_to_router[as_name].append(router)
         return super().add_router(router)
 
+    def remove_router(self, router: Router) -> None:
+        as_name = self.router_to_as.pop(router, None)
+        if as_name is None:
+            return
+        self.meshed = None
+        self.as_to_router[as_name].remove(router)
+        cluster = self.router_to_cluster.pop(router, None)
+        if cluster is not None:
+            if router in cluster.reflectors:
+                cluster.reflectors.remove(router)
+                self.reflectors[as_name].discard(router)
+            else:
+                cluster.clients.remove(router)
+            # the clients of a cluster left without reflectors are meshed
+            if not cluster.reflectors:
+                self.clusters[as_name].remove(cluster)
+                for client in cluster.clients:
+                    del self.router_to_cluster[client]
+        if self.aggregates:
+            self.summarize_ases()
+
+    def add_cluster(self, as_name: str, cluster: Cluster):
+        self.meshed = None
+        self.clusters[as_name].append(cluster)
+        for router in cluster.reflectors + cluster.clients:
+            if router in self.router_to_cluster:
+                raise ValueError(f"{router.name} is in more than one bgp cluster")
+            if self.router_to_as.get(router) != as_name:
+                raise ValueError(f"{router.name} is not in AS {as_name}")
+            self.router_to_cluster[router] = cluster
+        self.reflectors[as_name].update(cluster.reflectors)
+
+    def summarize_ases(self):
+        for as_name, members in self.as_to_router.items():
+            lans = {lan: None for router in members for lan in router.get_lans()}
+            aggregates = summarize((lan.network, lan.prefixlen) for lan in lans)
+            self.aggregates[as_name] = {}
+            for lan in lans:
+                network, prefixlen = aggregates[(lan.network, lan.prefixlen)]
+                self.aggregates[as_name][lan] = f"{format_ip(network)}/{prefixlen}"
+
+    def get_networks(self, router: Router) -> list[str]:
+        lans = router.get_lans()
+        aggregates = self.aggregates.get(self.router_to_as[router])
+        if aggregates is None:
+            return [lan.full_address for lan in lans]
+        return list(dict.fromkeys(aggregates[lan] for lan in lans))
+
+    def get_ibgp_peers(self, router: Router) -> list[Router]:
+        # full mesh, unless the AS has route reflectors: then the reflectors
+        # are meshed together and with the routers outside the clusters, and
+        # the clients only talk to the reflectors of their cluster
+        as_name = self.router_to_as[router]
+        if not self.clusters[as_name]:
+            return [r for r in self.as_to_router[as_name] if r is not router]
+        if self.meshed is None:
+            self.index_sessions()
+            assert self.meshed is not None
+        cluster = self.router_to_cluster.get(router)
+        if cluster is None:
+            peers = self.meshed[as_name]
+        else:
+            reflectors, reflected = self.sessions[cluster]
+            peers = reflected if router in self.reflectors[as_name] else reflectors
+        return [r for r in peers if r is not router]
+
+    def index_sessions(self):
+        self.meshed = {}
+        self.sessions = {}
+        for as_name, clusters in self.clusters.items():
+            members = self.as_to_router[as_name]
+            position = {router: i for i, router in enumerate(members)}
+            meshed = [
+                r
+                for r in members
+                if r in self.reflectors[as_name] or r not in self.router_to_cluster
+            ]
+            self.meshed[as_name] = meshed
+            for cluster in clusters:
+                self.sessions[cluster] = (
+                    sorted(cluster.reflectors, key=position.__getitem__),
+                    sorted(meshed + cluster.clients, key=position.__getitem__),
+                )
+
+    def is_client_of(self, client: Router, reflector: Router) -> bool:
+        cluster = self.router_to_cluster.get(client)
+        return (
+            cluster is not None
+            and client not in self.reflectors[self.router_to_as[client]]
+            and reflector in cluster.reflectors
+        )
+
+
+class Cluster:
+    def __init__(self, reflectors: list[Router], clients: list[Router]) -> None:
+        self.reflectors = reflectors
+        self.clients = clients
+
+    def get_id(self) -> str | None:
+        # reflectors of the same cluster need the same id
+        return self.reflectors[0].router_id
+
 
 class BGPParser(FRRParser):  # Parses the bgp data
     def load(self, path: Path) -> Any:
@@ -270,6 +770,76 @@ class BGPParser(FRRParser):  # Parses the bgp data
     def get_name() -> str:
         return "bgp"
 
+    @staticmethod
+    def validate(data: Any, index: Index):
+        ases: dict[str, str] = {}
+        for line in data["AS"]:
+            ASn, *routers = line.split()
+            index.check_routers(f"bgp.json: AS {ASn}", routers)
+            for router in routers:
+                if router in ases and ases[router] != ASn:
+                    index.error(
+                        f"bgp.json: {router} is in AS {ases[router]} and AS {ASn}"
+                    )
+                ases[router] = ASn
+        # a router is in one cluster at most, and auto picks its reflectors
+        # among the routers of the AS that no line names
+        used: set[str] = set()
+        auto: dict[str, int] = defaultdict(int)
+        for line in data.get("reflectors", []):
+            head, _, tail = line.partition(":")
+            ASn, *words = head.split() or [""]
+            where = f"bgp.json: reflectors {ASn}"
+            if ASn not in ases.values():
+                index.error(f"{where}: AS {ASn} has no routers")
+                continue
+            if words[:1] == ["auto"]:
+                if len(words) > 2 or not all(word.isdigit() for word in words[1:]):
+                    index.error(f"{where}: expected 'auto [N]'")
+                elif words[1:] and int(words[1]) == 0:
+                    index.error(f"{where}: a cluster needs a reflector")
+                else:
+                    auto[ASn] += int(words[1]) if len(words) > 1 else 1
+                words = []
+            elif not words:
+                index.error(f"{where}: a cluster needs a reflector")
+            for router in words + tail.split():
+                if ases.get(router) != ASn:
+                    index.error(f"{where}: {router} is not a router of AS {ASn}")
+                elif router in used:
+                    index.error(f"{where}: {router} is in more than one cluster")
+                else:
+                    used.add(router)
+        for ASn, count in auto.items():
+            free = sum(
+                1 for router, name in ases.items() if name == ASn and router not in used
+            )
+            if count > free:
+                index.error(
+                    f"bgp.json: reflectors {ASn}: auto needs {count} routers"
+                    f" but AS {ASn} has {free} that are in no cluster"
+                )
+        validate_profile("bgp.json", data, index)
+
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        entries: dict[str, Any] = {}
+        ases: dict[str, list[str]] = defaultdict(list)
+        for line in data["AS"]:
+            ASn, *routers = line.split()
+            ases[ASn].extend(routers)
+            entries.update((f"routers/{router}", ASn) for router in routers)
+        entries.update((f"AS/{ASn}", routers) for ASn, routers in ases.items())
+        reflectors: dict[str, list[str]] = defaultdict(list)
+        for line in data.get("reflectors", []):
+            reflectors[line.split()[0]].append(line)
+        entries.update(
+            (f"reflectors/{ASn}", lines) for ASn, lines in reflectors.items()
+        )
+        entries["summarize"] = data.get("summarize", False)
+        entries["profile"] = data.get("profile")
+        return entries
+
     def get_daemon_type(self) -> type[Daemon]:
         return BGP
 
@@ -288,17 +858,89 @@ class BGPParser(FRRParser):  # Parses the bgp data
                 if r:
                     bgp.add_as_router(ASn, r)
 
+        # "<AS> <reflectors> [: <clients>]" where the reflectors can be
+        # "auto [N]", the N routers with the most neighbors in the AS
+        reflector_lines: list[str] = self.data.get("reflectors", [])
+        lines: list[tuple[str, list[str], str]] = []
+        # the routers written in the json, auto doesn't pick them
+        claimed: set[Router] = set()
+        for line in reflector_lines:
+            head, _, tail = line.partition(":")
+            words = head.split()
+            ASn = words.pop(0)
+            if ASn not in bgp.as_to_router:
+                raise ValueError(f"AS {ASn} has no routers")
+            lines.append((ASn, words, tail))
+            names = tail.split() if words[:1] == ["auto"] else words + tail.split()
+            claimed.update(self.get_router(topology, name) for name in names)
+        parsed: list[tuple[str, list[Router], list[Router] | None]] = []
+        for ASn, words, tail in lines:
+            if words[:1] == ["auto"]:
+                count = int(words[1]) if len(words) > 1 else 1
+                reflectors = self.choose_reflectors(bgp, ASn, count, claimed)
+                claimed.update(reflectors)
+            else:
+                reflectors = [self.get_router(topology, name) for name in words]
+            clients = None
+            if tail.strip():
+                clients = [self.get_router(topology, name) for name in tail.split()]
+            parsed.append((ASn, reflectors, clients))
+
+        # clusters without explicit clients get the rest of their AS
+        for ASn, reflectors, clients in parsed:
+            if clients is None:
+                clients = [r for r in bgp.as_to_router[ASn] if r not in claimed]
+                claimed.update(clients)
+            bgp.add_cluster(ASn, Cluster(reflectors, clients))
+
+        if self.data.get("summarize", False):
+            bgp.summarize_ases()
+        bgp.profile = get_profile(self.data)
+
+    @staticmethod
+    def get_router(topology: Topology, name: str) -> Router:
+        router = topology.get_router_by_name(name)
+        if router is None:
+            raise ValueError(f"{name} does not exist")
+        return router
+
+    @staticmethod
+    def choose_reflectors(
+        bgp: BGP, as_name: str, count: int, taken: set[Router]
+    ) -> list[Router]:
+        def degree(router: Router) -> int:
+            return sum(
+                1
+                for iface in router.get_neighbors()
+                if bgp.router_to_as.get(iface.router) == as_name
+            )
+
+        members = bgp.as_to_router[as_name]
+        ranked = sorted(members, key=lambda r: (-degree(r), r.name))
+        return [r for r in ranked if r not in taken][:count]
+
 
 class BGPConfigurer(DaemonConfigurer):  # Writes the bgp config
     def __init__(self, bgp: BGP) -> None:
         self.bgp = bgp
 
-    def configure(self, router: Router, path: Path, data: Path):
-        with path.joinpath("etc/frr/daemons").open("a") as f:
-            f.write("\nbgpd=yes")
+    def configure(self, router: Router, output: LabOutput, data: Path):
+        as_name = self.bgp.router_to_as[router]
+        # the sessions come from the AS and its clusters, the remote ASes from
+        # the routers of the neighbors. The static routers leave their AS
+        with output.depends_on(
+            f"bgp.json:AS/{as_name}",
+            f"bgp.json:reflectors/{as_name}",
+            "bgp.json:summarize",
+            "bgp.json:profile",
+            "static.json:routers",
+        ):
+            self.write(router, as_name, output)
+
+    def write(self, router: Router, as_name: str, output: LabOutput):
+        output.append(f"{router.name}/etc/frr/daemons", "\nbgpd=yes")
 
         lines: list[str] = []
-        as_name = self.bgp.router_to_as[router]
         lines.append("""log file /var/log/frr/frr.log
 
 debug bgp
@@ -310,6 +952,13 @@ debug bgp updates
                      
 """)
         lines.append(f"router bgp {as_name}\n\n")
+        profile = self.bgp.profile
+        if profile is not None:
+            lines.append(f"timers bgp {profile.keepalive} {profile.hold}\n\n")
+        cluster = self.bgp.router_to_cluster.get(router)
+        if cluster is not None and router in cluster.reflectors:
+            if len(cluster.reflectors) > 1:
+                lines.append(f"bgp cluster-id {cluster.get_id()}\n\n")
         lines.append(f"redistribute rip\n\n")
         lines.append(f"redistribute ospf\n\n")
         lines.append(f"no bgp ebgp-requires-policy\n")
@@ -323,41 +972,224 @@ debug bgp updates
         esterni = [
             iface for iface in vicini if self.bgp.router_to_as[iface.router] != as_name
         ]
-        interni = [iface for iface in vicini if iface not in esterni]
+        peers = self.bgp.get_ibgp_peers(router)
+        peer_set = set(peers)
+        interni = [iface for iface in vicini if iface.router in peer_set]
+        connessi = {iface.router for iface in interni}
 
         # aggiunge tutti i neighbors interni
-        non_connessi = [
-            r
-            for r in self.bgp.as_to_router[as_name]
-            if r not in (interface.router for interface in interni) and r is not router
-        ]
+        non_connessi = [r for r in peers if r not in connessi]
         for rt in non_connessi:
             lines.append(
                 f"neighbor <{rt.name} {rt.router_id}> remote-as {as_name}\n"
             )
             lines.append(
-                f"neighbor <{rt.name} {rt.router_id}> description {rt.name}\n\n"
+                f"neighbor <{rt.name} {rt.router_id}> description {rt.name}\n"
             )
+            if self.bgp.is_client_of(rt, router):
+                lines.append(
+                    f"neighbor <{rt.name} {rt.router_id}> route-reflector-client\n"
+                )
+            lines.extend(self.tune(f"<{rt.name} {rt.router_id}>", False))
+            lines.append("\n")
 
         for iface in interni:
             lines.append(f"neighbor {iface.address} remote-as {as_name}\n")
             lines.append(
-                f"neighbor {iface.address} description {iface.router.name}\n\n"
+                f"neighbor {iface.address} description {iface.router.name}\n"
             )
+            if self.bgp.is_client_of(iface.router, router):
+                lines.append(f"neighbor {iface.address} route-reflector-client\n")
+            lines.extend(self.tune(iface.address, True))
+            lines.append("\n")
 
         # aggiunge tutti i neighbors esterni
         for interface in esterni:
-            if self.bgp.router_to_as[interface.router] != as_name:
-                lines.append(
-                    f"neighbor {interface.address} remote-as {self.bgp.router_to_as[interface.router]}\n"
-                )
-                lines.append(
-                    f"neighbor {interface.address} description {interface.router.name}\n\n"
-                )
+            lines.append(
+                f"neighbor {interface.address} remote-as {self.bgp.router_to_as[interface.router]}\n"
+            )
+            lines.append(
+                f"neighbor {interface.address} description {interface.router.name}\n"
+            )
+            lines.extend(self.tune(interface.address, True))
+            lines.append("\n")
 
         # aggiunge tutte le network
-        for lan in router.get_lans():
-            lines.append(f"network {lan.full_address}\n")
+        for network in self.bgp.get_networks(router):
+            lines.append(f"network {network}\n")
+
+        output.extend(f"{router.name}/etc/frr/frr.conf", lines)
+
+    def tune(self, neighbor: str, connected: bool) -> list[str]:
+        # the timers of the profile for a session, bfd only on a shared lan
+        profile = self.bgp.profile
+        if profile is None:
+            return []
+        interval = profile.advertisement
+        lines = [f"neighbor {neighbor} advertisement-interval {interval}\n"]
+        if profile.bfd and connected:
+            lines.append(f"neighbor {neighbor} bfd\n")
+        return lines
+
+
+class StaticParser(FRRParser):  # Parses the routers that use static routes
+    def load(self, path: Path) -> Any:
+        with path.open("r") as l:
+            return json.load(l)
+
+    def merge(self, topology: Topology):
+        routers: list[str] = self.data["routers"]
+        parsed_routers = topology.get_router_map()
+        static = self.get_static()
+        static.default_cost = int(self.data.get("default_cost", DEFAULT_COST))
+
+        # the ospf costs are used where the file doesn't give its own
+        ospf = self.frr.get_daemon("ospf")
+        if isinstance(ospf, OSPF):
+            for router_costs in ospf.costs.values():
+                for cost in router_costs:
+                    static.add_cost(cost.interface, int(cost.value))
+        for line in self.data.get("costs", []):
+            router, interface, value = line.split()
+            static.add_cost(
+                parsed_routers[router].get_interface(interface), int(value)
+            )
+
+        for router in routers:
+            static.add_router(parsed_routers[router])
+        static.build(topology)
+
+    @staticmethod
+    def get_name() -> str:
+        return "static"
+
+    @staticmethod
+    def validate(data: Any, index: Index):
+        index.check_routers("static.json: routers", data["routers"])
+        validate_costs("static.json", data.get("costs", []), index)
+        if not str(data.get("default_cost", DEFAULT_COST)).isdigit():
+            index.error("static.json: default_cost should be a number")
+
+    @staticmethod
+    def get_entries(data: Any) -> dict[str, Any]:
+        entries: dict[str, Any] = get_members(data["routers"])
+        entries["costs"] = data.get("costs", [])
+        entries["default_cost"] = data.get("default_cost", DEFAULT_COST)
+        return entries
+
+    def get_daemon_type(self) -> type[Daemon]:
+        return Static
+
+    def get_static(self) -> Static:
+        return self.get_daemon()  # type:ignore
+
+
+class StaticConfigurer(DaemonConfigurer):
+    def __init__(self, daemon: Static) -> None:
+        self.daemon = daemon
 
-        with path.joinpath("etc/frr/frr.conf").open("a") as f:
-            f.writelines(lines)
+    def configure(self, router: Router, output: LabOutput, data: Path):
+        prefixes = self.daemon.prefixes
+        addresses: dict[Interface, str] = {}
+        lines: list[str] = []
+        for lan, hop in self.daemon.get_routes(router):
+            if hop not in addresses:
+                addresses[hop] = hop.address
+            lines.append(f"ip route add {prefixes[lan]} via {addresses[hop]}\n")
+
+        # every route can go through any of the static routers
+        with output.depends_on("static.json", "ospf.json:costs"):
+            output.extend(f"{router.name}.startup", lines)
+
+
+# cost of the interfaces without an explicit one
+DEFAULT_COST = 10
+
+
+class Static(FRRDaemon):  # Computes the routes of the routers without daemons
+    def __init__(self) -> None:
+        super().__init__()
+        self.configurer = StaticConfigurer(self)
+        self.routers: dict[Router, None] = {}
+        self.costs: dict[Interface, int] = {}
+        self.default_cost = DEFAULT_COST
+        # built once after merging, shared by the searches of every router
+        self.links: dict[Router, list[tuple[int, Router, Interface]]] = {}
+        self.stubs: dict[Router, list[tuple[Lan, int]]] = {}
+        self.prefixes: dict[Lan, str] = {}
+        self.lans: list[Lan] = []
+
+    def get_configurer(self) -> DaemonConfigurer:
+        return self.configurer
+
+    def add_router(self, router: Router) -> None:
+        # the static routes replace the other frr daemons of the router
+        self.routers[router] = None
+        self.frr.replace_daemons(self, router)
+
+    def uses_frr(self) -> bool:
+        return False
+
+    def add_cost(self, interface: Interface, value: int):
+        self.costs[interface] = value
+
+    def get_cost(self, interface: Interface) -> int:
+        return self.costs.get(interface, self.default_cost)
+
+    def build(self, topology: Topology):
+        # the graph of the static routers, with the cost of leaving each one
+        # towards each neighbor and towards each of its lans
+        for router in self.routers:
+            links: list[tuple[int, Router, Interface]] = []
+            stubs: list[tuple[Lan, int]] = []
+            for interface in router.interfaces.values():
+                cost = self.get_cost(interface)
+                stubs.append((interface.lan, cost))
+                for neighbor in interface.lan.interfaces:
+                    other = neighbor.router
+                    if other in self.routers and other is not router:
+                        links.append((cost, other, neighbor))
+            self.links[router] = links
+            self.stubs[router] = stubs
+        self.lans = topology.get_lans()
+        self.prefixes = {
+            lan: f"{format_ip(lan.network)}/{lan.prefixlen}" for lan in self.lans
+        }
+
+    def get_first_hops(self, source: Router) -> dict[Router, tuple[int, Interface]]:
+        # dijkstra from source through the static routers: one search gives
+        # the distance and the next hop for all the destinations
+        distances: dict[Router, int] = {source: 0}
+        hops: dict[Router, Interface] = {}
+        result: dict[Router, tuple[int, Interface]] = {}
+        order = count()
+        heap: list[tuple[int, int, Router]] = [(0, next(order), source)]
+        while heap:
+            distance, _, router = heappop(heap)
+            if router in result:
+                continue
+            if router is not source:
+                result[router] = (distance, hops[router])
+            for cost, other, neighbor in self.links[router]:
+                weight = distance + cost
+                if other in result or other is source:
+                    continue
+                if other not in distances or weight < distances[other]:
+                    distances[other] = weight
+                    hops[other] = neighbor if router is source else hops[router]
+                    heappush(heap, (weight, next(order), other))
+        return result
+
+    def get_routes(self, router: Router) -> list[tuple[Lan, Interface]]:
+        connected = set(router.get_lans())
+        best: dict[Lan, tuple[int, Interface]] = {}
+        for other, (distance, hop) in self.get_first_hops(router).items():
+            for lan, cost in self.stubs[other]:
+                cost += distance
+                if lan not in best or cost < best[lan][0]:
+                    if lan not in connected:
+                        best[lan] = (cost, hop)
+        return [(lan, best[lan][1]) for lan in self.lans if lan in best]
+
+
+PARSERS: tuple[type[FRRParser], ...] = (OSPFParser, RIPParser, BGPParser, StaticParser)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import hashlib
+import json
+from importlib import import_module
+from importlib.metadata import entry_points
+from pathlib import Path
+from typing import Any
+from daemon.classes import DaemonParser
+from topology.classes import Topology
+from topology.parser import parse_json
+
+# entry point group where other packages can register their parsers, with the
+# name of their json file as the name of the entry point
+ENTRY_POINTS = "kathara_lab_starter.daemons"
+
+
+class Entry:
+    # A parser that is imported only when its json file is in the config.
+    # The parsers of a group are merged together by the group's class, like
+    # the FRR daemons, the others are merged one at a time like DNS
+    def __init__(self, name: str, target: str, group: str | None = None) -> None:
+        self.name = name
+        self.target = target
+        self.group = group
+        self.parser: type[DaemonParser] | None = None
+
+    def get_file(self) -> str:
+        return f"{self.name}.json"
+
+    def get_tag(self) -> str:
+        return self.group if self.group is not None else self.name
+
+    def load(self) -> type[DaemonParser]:
+        if self.parser is None:
+            self.parser = load_target(self.target)
+        return self.parser
+
+
+def load_target(target: str) -> Any:
+    module, _, attribute = target.partition(":")
+    return getattr(import_module(module), attribute)
+
+
+# classes that merge the parsers of a group, called with the config directory,
+# the topology and the parser classes in order
+GROUPS: dict[str, str] = {"frr": "daemon.frr.frr:FRR"}
+
+BUILTIN: list[Entry] = [
+    Entry("ospf", "daemon.frr.frr:OSPFParser", "frr"),
+    Entry("rip", "daemon.frr.frr:RIPParser", "frr"),
+    Entry("bgp", "daemon.frr.frr:BGPParser", "frr"),
+    Entry("static", "daemon.frr.frr:StaticParser", "frr"),
+    Entry("dns", "daemon.dns.parser:DNSParser"),
+]
+
+_entries: dict[str, Entry] | None = None
+
+
+def get_entries() -> dict[str, Entry]:
+    # the built in parsers first, the order is the one of the merge
+    global _entries
+    if _entries is None:
+        _entries = {entry.name: entry for entry in BUILTIN}
+        try:
+            plugins = entry_points(group=ENTRY_POINTS)
+        except TypeError:  # python < 3.10
+            plugins = entry_points().get(ENTRY_POINTS, [])  # type:ignore
+        for plugin in plugins:
+            if plugin.name not in _entries:
+                _entries[plugin.name] = Entry(plugin.name, plugin.value)
+    return _entries
+
+
+def get_entry(file: str) -> Entry | None:
+    # the entry of a config file name like "ospf.json"
+    name = Path(file).name
+    if not name.endswith(".json"):
+        return None
+    return get_entries().get(name.removesuffix(".json"))
+
+
+def get_present(config: Path) -> list[Entry]:
+    return [
+        entry
+        for entry in get_entries().values()
+        if config.joinpath(entry.get_file()).exists()
+    ]
+
+
+def get_tags() -> list[str]:
+    return list(dict.fromkeys(entry.get_tag() for entry in get_entries().values()))
+
+
+def merge(config: Path, topology: Topology, tags: set[str] | None = None):
+    # merges the json files in config, importing only their parsers, in the
+    # order of the tags so that the files they share always look the same
+    present: dict[str, list[Entry]] = {}
+    for entry in get_present(config):
+        if tags is None or entry.get_tag() in tags:
+            present.setdefault(entry.get_tag(), []).append(entry)
+    for tag, entries in present.items():
+        if tag in GROUPS:
+            parsers = [entry.load() for entry in entries]
+            load_target(GROUPS[tag])(config, topology, parsers)
+        else:
+            for entry in entries:
+                entry.load()(config.joinpath(entry.get_file())).merge(topology)
+        # the daemons are tagged like their entry, whatever their class is
+        for router in topology.routers:
+            for daemon in router.daemons:
+                if daemon.tag is None:
+                    daemon.tag = tag
+
+
+def hash_entry(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def get_inputs(contents: dict[str, Any]) -> dict[str, dict[str, str]]:
+    # the hashes of the entries of the daemon json files (keyed by file name,
+    # None when missing), to tell on the next run which entries changed
+    inputs: dict[str, dict[str, str]] = {}
+    for name, data in contents.items():
+        entry = get_entry(name)
+        if entry is not None and data is not None:
+            entries = entry.load().get_entries(data)
+            inputs[name] = {key: hash_entry(value) for key, value in entries.items()}
+    return inputs
+
+
+def read_inputs(config: Path) -> dict[str, dict[str, str]]:
+    return get_inputs(
+        {
+            entry.get_file(): parse_json(config.joinpath(entry.get_file()))
+            for entry in get_present(config)
+        }
+    )
+
+
+def get_changes(
+    old: dict[str, dict[str, str]], new: dict[str, dict[str, str]]
+) -> set[str]:
+    # the entries that differ, like "ospf.json:costs/r1"
+    changes: set[str] = set()
+    for name in old.keys() | new.keys():
+        before, after = old.get(name, {}), new.get(name, {})
+        changes.update(
+            f"{name}:{key}"
+            for key in before.keys() | after.keys()
+            if before.get(key) != after.get(key)
+        )
+    return changes
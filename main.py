@@ -1,14 +1,227 @@
-from pathlib import Path
+import cProfile
+import json
 import sys
-from topology.wizard import configure_topology
+from argparse import ArgumentParser
+from pathlib import Path
+from topology import stats
+from topology.archive import FORMATS
+from topology.batch import Batch
+from topology.validate import ValidationError
+from topology.watch import Watcher
+from topology.wizard import (
+    DAEMON_TAGS,
+    configure_topology,
+    get_tags,
+    rebuild,
+    refresh,
+)
+
+
+def invalid(error: ValidationError):
+    print("The config is not valid:", file=sys.stderr)
+    for line in error.errors:
+        print("    " + line, file=sys.stderr)
+    exit(2)
+
+
+def run_check(argv: list[str]):
+    parser = ArgumentParser(
+        prog="main.py check",
+        description="Predicts which devices of the lab can reach each other",
+    )
+    parser.add_argument("config", type=Path, help="config directory")
+    parser.add_argument(
+        "--limit", type=int, default=8, help="unreachable devices listed per device"
+    )
+    args = parser.parse_args(argv)
+    # the simulator needs all the frr daemons, so it's imported only here
+    from topology.check import check
+
+    try:
+        report = check(args.config)
+    except ValidationError as e:
+        invalid(e)
+    print(report.get_summary(args.limit))
+    exit(0 if report.is_ok() else 1)
+
+
+def run_check_dns(argv: list[str]):
+    parser = ArgumentParser(
+        prog="main.py check-dns",
+        description="Resolves every name of dns.json from every resolver",
+    )
+    parser.add_argument("config", type=Path, help="config directory")
+    parser.add_argument(
+        "--limit", type=int, default=8, help="failed names listed per resolver"
+    )
+    args = parser.parse_args(argv)
+    from topology.check import check_dns
+
+    try:
+        report = check_dns(args.config)
+    except ValidationError as e:
+        invalid(e)
+    print(report.get_summary(args.limit))
+    exit(0 if report.is_ok() else 1)
+
+
+def run_batch(argv: list[str]):
+    parser = ArgumentParser(
+        prog="main.py batch",
+        description="Generates a lab for each overlay applied to the config",
+    )
+    parser.add_argument("config", type=Path, help="base config directory")
+    parser.add_argument("target", type=Path, help="a lab is made in target/<overlay>")
+    parser.add_argument(
+        "overlays",
+        type=Path,
+        nargs="+",
+        metavar="OVERLAY",
+        help='json like {"ospf.json": {"costs": [...]}}, merged into the config',
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="variants rendered in parallel"
+    )
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="hardlink the files copied unchanged from data instead of copying them",
+    )
+    args = parser.parse_args(argv)
+    try:
+        batch = Batch(args.config, args.target, args.overlays, link=args.link)
+        results = batch.run(args.jobs)
+    except ValidationError as e:
+        invalid(e)
+    for name, changes in results.items():
+        print(f"{name}: " + changes.get_summary().replace("\n", f"\n{name}: "))
+    exit(0)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <config directory> <target directory>")
-        exit(1)
+    if sys.argv[1:2] == ["check"]:
+        run_check(sys.argv[2:])
+    if sys.argv[1:2] == ["check-dns"]:
+        run_check_dns(sys.argv[2:])
+    if sys.argv[1:2] == ["batch"]:
+        run_batch(sys.argv[2:])
+
+    parser = ArgumentParser(description="Generates a kathara lab from json files")
+    parser.add_argument("config", type=Path, help="config directory")
+    parser.add_argument("target", type=Path, help="target directory")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="routers configured in parallel"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="use a pool of processes instead of threads for --jobs",
+    )
+    parser.add_argument(
+        "--link",
+        action="store_true",
+        help="hardlink the files copied unchanged from data instead of copying them",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["dir", *FORMATS],
+        default="dir",
+        help="write the lab as a directory or as a single archive (- for stdout)",
+    )
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=DAEMON_TAGS,
+        help="render again only the files of these daemons",
+    )
+    parser.add_argument(
+        "--changed",
+        nargs="+",
+        metavar="FILE",
+        help="render again only the devices that depend on the changes to these files",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and regenerate the lab when the config changes",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=0.5, help="seconds between checks in --watch"
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="print the time spent in each phase"
+    )
+    parser.add_argument(
+        "--stats-json", type=Path, metavar="FILE", help="save the stats as json"
+    )
+    parser.add_argument(
+        "--profile", type=Path, metavar="FILE", help="save a cProfile dump of the run"
+    )
+    args = parser.parse_args()
+    if args.format != "dir" and (args.watch or args.only or args.changed):
+        parser.error("--format only works when generating the whole lab")
+    # the archive may be going to stdout
+    out = sys.stderr if args.format != "dir" else sys.stdout
+
+    if args.watch:
+        watcher = Watcher(
+            args.config, args.target, link=args.link, interval=args.interval
+        )
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+        except ValidationError as e:
+            invalid(e)
+        exit(0)
+
+    recorder = None
+    if args.stats or args.stats_json is not None or args.profile is not None:
+        recorder = stats.enable()
+    profiler = cProfile.Profile() if args.profile is not None else None
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with stats.timer("phase", "total"):
+            if args.only is None and args.changed is not None:
+                changes = refresh(
+                    args.config,
+                    args.target,
+                    args.changed,
+                    jobs=args.jobs,
+                    processes=args.processes,
+                    link=args.link,
+                )
+            elif args.only is not None:
+                changes = rebuild(
+                    args.config,
+                    args.target,
+                    set(args.only or []) | get_tags(args.changed or []),
+                    jobs=args.jobs,
+                    processes=args.processes,
+                    link=args.link,
+                )
+            else:
+                changes = configure_topology(
+                    args.config,
+                    args.target,
+                    jobs=args.jobs,
+                    processes=args.processes,
+                    link=args.link,
+                    format=args.format,
+                )
+    except ValidationError as e:
+        invalid(e)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
 
-    config = Path(sys.argv[1])
-    target = Path(sys.argv[2])
+    if args.format == "dir":
+        print(changes.get_summary(), file=out)
 
-    configure_topology(config, target)
+    if recorder is not None:
+        print(recorder.get_summary(), file=out)
+        if args.stats_json is not None:
+            with args.stats_json.open("w") as f:
+                json.dump(recorder.to_json(), f, indent=1)
@@ -0,0 +1,46 @@
+from __future__ import annotations
+from bisect import bisect_right
+from ipaddress import IPv4Network, collapse_addresses
+from typing import Iterable
+
+
+def parse_ip(address: str) -> int:
+    a, b, c, d = address.split(".")
+    value = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    if not 0 <= value <= 0xFFFFFFFF or any(
+        not 0 <= int(byte) <= 255 for byte in (a, b, c, d)
+    ):
+        raise ValueError(f"{address} is not a valid ipv4 address")
+    return value
+
+
+def format_ip(value: int) -> str:
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def get_mask(prefixlen: int) -> int:
+    return (0xFFFFFFFF << (32 - prefixlen)) & 0xFFFFFFFF
+
+
+def parse_prefix(full_address: str) -> tuple[int, int]:
+    address, _, prefixlen = full_address.partition("/")
+    length = int(prefixlen) if prefixlen else 32
+    if not 0 <= length <= 32:
+        raise ValueError(f"{full_address} has an invalid netmask")
+    return parse_ip(address), length
+
+
+def summarize(
+    prefixes: Iterable[tuple[int, int]]
+) -> dict[tuple[int, int], tuple[int, int]]:
+    # maps every (network, prefixlen) to the aggregate that covers it, only
+    # contiguous prefixes are merged so no foreign address is announced
+    prefixes = set(prefixes)
+    aggregates = [
+        (int(net.network_address), net.prefixlen)
+        for net in collapse_addresses(IPv4Network(p) for p in prefixes)
+    ]
+    starts = [network for network, _ in aggregates]
+    return {
+        prefix: aggregates[bisect_right(starts, prefix[0]) - 1] for prefix in prefixes
+    }
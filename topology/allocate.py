@@ -0,0 +1,180 @@
+from __future__ import annotations
+import heapq
+from typing import Any
+from topology.address import format_ip, get_mask, parse_ip, parse_prefix
+from topology.expand import expand_lans, expand_routers
+
+AUTO = "auto"
+
+
+def get_prefixlen(count: int) -> int:
+    # the smallest subnet with a host for each interface, /30 for links
+    return 32 - max(2, (count + 1).bit_length())
+
+
+class SubnetAllocator:
+    # Buddy allocator over the pools: the free subnets are kept by prefix
+    # length, a subnet is taken from the smallest free one that can hold it
+    # and what is left is split in halves that go back to the free lists
+    def __init__(self, pools: list[tuple[int, int]]) -> None:
+        self.pools = [
+            (ip & get_mask(prefixlen), prefixlen) for ip, prefixlen in pools
+        ]
+        self.free: list[set[int]] = [set() for _ in range(33)]
+        self.heaps: list[list[int]] | None = None
+        for network, prefixlen in self.pools:
+            self.pin(network, prefixlen)
+            self.free[prefixlen].add(network)
+
+    def pin(self, network: int, prefixlen: int):
+        # the subnet is in use, its addresses are removed from the free ones
+        assert self.heaps is None, "the pins come before the allocations"
+        network &= get_mask(prefixlen)
+        end = network + (1 << (32 - prefixlen))
+        if not any(
+            pool < end and network < pool + (1 << (32 - length))
+            for pool, length in self.pools
+        ):
+            return
+        for length in range(prefixlen, -1, -1):
+            block = network & get_mask(length)
+            if block in self.free[length]:
+                self.free[length].remove(block)
+                for split in range(length + 1, prefixlen + 1):
+                    buddy = (network & get_mask(split)) ^ (1 << (32 - split))
+                    self.free[split].add(buddy)
+                return
+        # it covers some free subnets without being inside one of them
+        for length in range(prefixlen + 1, 33):
+            self.free[length] = {
+                block for block in self.free[length] if not network <= block < end
+            }
+
+    def allocate(self, prefixlen: int) -> int | None:
+        if self.heaps is None:
+            # lowest addresses first, so the result doesn't depend on the sets
+            self.heaps = [sorted(blocks) for blocks in self.free]
+        for length in range(prefixlen, -1, -1):
+            if self.heaps[length]:
+                network = heapq.heappop(self.heaps[length])
+                for split in range(length + 1, prefixlen + 1):
+                    heapq.heappush(self.heaps[split], network | (1 << (32 - split)))
+                return network
+        return None
+
+
+class Hosts:
+    # bitmap of the addresses of a lan that are in use, the free one with the
+    # lowest address is the lowest zero bit
+    def __init__(self, network: int, prefixlen: int) -> None:
+        self.network = network
+        self.size = 1 << (32 - prefixlen)
+        self.used = 0
+        if prefixlen < 31:
+            self.used = 1 | (1 << (self.size - 1))
+
+    def pin(self, ip: int):
+        if 0 <= ip - self.network < self.size:
+            self.used |= 1 << (ip - self.network)
+
+    def take(self) -> int | None:
+        offset = (~self.used & (self.used + 1)).bit_length() - 1
+        if offset >= self.size:
+            return None
+        self.used |= 1 << offset
+        return self.network + offset
+
+
+class Addressing:
+    # The addresses of the lans and of the interfaces of a topology json.
+    # LANs written as "auto" get a subnet from the "pools" sized for their
+    # interfaces, interfaces written as "auto <lan>" the first free address
+    # of the lan; the addresses written in the json are kept and never given
+    # to anything else
+    def __init__(self, data: Any) -> None:
+        self.lans: dict[str, str] = {}
+        self.duplicates: list[str] = []
+        for name, full_address in expand_lans(data.get("lans", {})):
+            if name in self.lans:
+                self.duplicates.append(name)
+            self.lans[name] = full_address
+        self.networks: dict[str, tuple[int, int]] = {}
+        auto: list[str] = []
+        for name, full_address in self.lans.items():
+            if full_address == AUTO:
+                auto.append(name)
+                continue
+            try:
+                self.networks[name.upper()] = parse_prefix(full_address)
+            except ValueError:
+                continue  # reported by the validation
+        self.hosts: dict[str, Hosts] = {}
+        self.pinned: dict[str, list[int]] = {}
+
+        routers: dict[str, dict[str, str]] = data.get("routers", {})
+        has_auto = any(
+            interface_data.split()[:1] == [AUTO]
+            for interfaces in routers.values()
+            for interface_data in interfaces.values()
+        )
+        if not auto and not has_auto:
+            return
+
+        # the interfaces are counted, and their addresses pinned, before
+        # anything is given out
+        counts: dict[str, int] = {name.upper(): 0 for name in auto}
+        pending: list[tuple[str, str]] = []
+        for _, interfaces in expand_routers(routers):
+            for _, interface_data in interfaces:
+                words = interface_data.split()
+                if len(words) != 2:
+                    continue
+                lan = words[1].upper()
+                if lan in counts:
+                    counts[lan] += 1
+                if words[0] != AUTO and (lan in counts or lan in self.networks):
+                    pending.append((lan, words[0]))
+        if auto:
+            self.allocate(auto, counts, data.get("pools", []))
+        for lan, host in pending:
+            try:
+                self.pinned.setdefault(lan, []).append(self.get_ip(lan, host))
+            except ValueError:
+                continue  # reported by the validation
+
+    def allocate(self, auto: list[str], counts: dict[str, int], pools: list[str]):
+        if not pools:
+            raise ValueError(f"lan {auto[0]} is auto but there are no pools")
+        allocator = SubnetAllocator([parse_prefix(pool) for pool in pools])
+        for network, prefixlen in self.networks.values():
+            allocator.pin(network, prefixlen)
+        # the biggest first, they need the most aligned subnets
+        sizes = {name: get_prefixlen(counts[name.upper()]) for name in auto}
+        for name in sorted(auto, key=sizes.__getitem__):
+            prefixlen = sizes[name]
+            network = allocator.allocate(prefixlen)
+            if network is None:
+                raise ValueError(f"the pools have no room for lan {name} /{prefixlen}")
+            self.lans[name] = f"{format_ip(network)}/{prefixlen}"
+            self.networks[name.upper()] = (network, prefixlen)
+
+    def get_ip(self, lan: str, host: str) -> int:
+        # a byte replaces the last byte of the lan address, like it always did,
+        # a full address can be any address of the lan
+        ip, prefixlen = self.networks[lan]
+        if host == AUTO:
+            if lan not in self.hosts:
+                hosts = Hosts(ip & get_mask(prefixlen), prefixlen)
+                for pinned in self.pinned.get(lan, []):
+                    hosts.pin(pinned)
+                self.hosts[lan] = hosts
+            result = self.hosts[lan].take()
+            if result is None:
+                raise ValueError(f"lan {lan} has no free addresses")
+            return result
+        if host.isdigit() and int(host) <= 255:
+            return (ip & 0xFFFFFF00) | int(host)
+        try:
+            return parse_ip(host)
+        except ValueError:
+            raise ValueError(f"{host} is not a valid byte or address")
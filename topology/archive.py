@@ -0,0 +1,66 @@
+import sys
+import tarfile
+import time
+from io import BytesIO
+from pathlib import Path
+from topology import stats
+from topology.manifest import Changes, get_device
+from topology.output import LabOutput, TemplateFile
+
+FORMATS = {"tar": "w|", "tar.gz": "w|gz"}
+
+
+def make_info(
+    name: str, mtime: float, kind: bytes = tarfile.REGTYPE
+) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.type = kind
+    info.mtime = int(mtime)
+    info.mode = 0o755 if kind == tarfile.DIRTYPE else 0o644
+    return info
+
+
+def add_content(
+    archive: tarfile.TarFile, relative: str, mtime: float, content: bytes
+):
+    info = make_info(relative, mtime)
+    info.size = len(content)
+    archive.addfile(info, BytesIO(content))
+
+
+def write_archive(
+    output: LabOutput, target: Path, format: str = "tar", link: bool = False
+) -> Changes:
+    # streams every file into a single archive (stdout when target is "-"),
+    # without writing the lab to disk. With link, the files copied unchanged
+    # from a template are stored once and hardlinked by the others.
+    changes = Changes()
+    mtime = time.time()
+    stream = sys.stdout.buffer if target.as_posix() == "-" else target.open("wb")
+    try:
+        with tarfile.open(fileobj=stream, mode=FORMATS[format]) as archive:
+            for directory in sorted(output.get_directories()):
+                archive.addfile(make_info(directory, mtime, tarfile.DIRTYPE))
+            first: dict[TemplateFile, str] = {}
+            for relative in output.get_paths():
+                template = output.get_template_file(relative)
+                if template is None:
+                    content = output.render(relative)
+                    add_content(archive, relative, mtime, content)
+                else:
+                    with stats.timer("copy", template.root.as_posix()):
+                        content = template.text.encode()
+                        if link and template in first:
+                            info = make_info(relative, mtime, tarfile.LNKTYPE)
+                            info.linkname = first[template]
+                            archive.addfile(info)
+                        else:
+                            add_content(archive, relative, mtime, content)
+                            first[template] = relative
+                stats.add_file(get_device(relative) or "lab", len(content), True)
+                changes.written.append(relative)
+    finally:
+        if stream is not sys.stdout.buffer:
+            stream.close()
+    changes.written.sort()
+    return changes
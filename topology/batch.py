@@ -0,0 +1,171 @@
+from __future__ import annotations
+import json
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+from daemon import registry
+from topology import output
+from topology.classes import Topology
+from topology.manifest import Changes, sync
+from topology.output import LabOutput, TemplateCache
+from topology.parser import get_topology, parse_json
+from topology.validate import ValidationError
+from topology.wizard import (
+    get_affected,
+    merge_daemons,
+    render,
+    rerender,
+    validate_config,
+)
+
+
+def merge_patch(base: Any, patch: Any) -> Any:
+    # json merge patch (rfc 7386): the parts of base that the patch doesn't
+    # touch are shared with the result, not copied
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(base) if isinstance(base, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def load_config(config: Path) -> dict[str, Any]:
+    return {path.name: parse_json(path) for path in sorted(config.glob("*.json"))}
+
+
+class Variant:
+    # A config made of the base one and an overlay like
+    # {"ospf.json": {"costs": [...]}, "static.json": null}
+    def __init__(self, overlay: Path, base: dict[str, Any], folder: Path) -> None:
+        self.name = overlay.stem
+        self.files = dict(base)
+        patches: dict[str, Any] = parse_json(overlay)
+        wrong = [name for name in patches if not name.endswith(".json")]
+        if wrong:
+            raise ValidationError(
+                [f"{self.name}: {name} is not a config file" for name in wrong]
+            )
+        for name, patch in patches.items():
+            if patch is None:
+                self.files.pop(name, None)
+            else:
+                self.files[name] = merge_patch(self.files.get(name), patch)
+        self.changed = {
+            name
+            for name in base.keys() | self.files.keys()
+            if base.get(name) != self.files.get(name)
+        }
+        # the parsers read their json from files
+        self.config = folder.joinpath(self.name)
+        self.config.mkdir(parents=True)
+        for name, content in self.files.items():
+            with self.config.joinpath(name).open("w") as f:
+                json.dump(content, f)
+
+
+class Batch:
+    # Renders the base config once; each variant copies the rendered lab and
+    # renders again only the routers with files that depend on what its overlay
+    # changes, so the routers that are the same in every variant are rendered once
+    def __init__(
+        self,
+        config: Path,
+        target: Path,
+        overlays: list[Path],
+        data: Path = Path("data"),
+        link: bool = False,
+    ) -> None:
+        self.config = config
+        self.target = target
+        self.data = data
+        self.link = link
+        names = [overlay.stem for overlay in overlays]
+        if len(set(names)) < len(names):
+            raise ValidationError(["two overlays have the same file name"])
+        self.base = load_config(config)
+        self.folder = tempfile.TemporaryDirectory()
+        self.variants: list[Variant] = []
+        errors: list[str] = []
+        for overlay in overlays:
+            try:
+                variant = Variant(overlay, self.base, Path(self.folder.name))
+            except ValidationError as e:
+                errors.extend(e.errors)
+                continue
+            try:
+                validate_config(variant.config)
+            except ValidationError as e:
+                errors.extend(f"{variant.name}: {error}" for error in e.errors)
+            self.variants.append(variant)
+        if errors:
+            self.folder.cleanup()
+            raise ValidationError(errors)
+        self.topology: Topology | None = None
+        self.output = LabOutput()
+
+    def render_base(self):
+        validate_config(self.config)
+        self.topology = get_topology(self.config.joinpath("topology.json"))
+        self.output = render(self.config, self.topology, self.data)
+        # the variants share the rendered chunks
+        self.output.freeze()
+
+    def render_variant(self, variant: Variant) -> Changes:
+        target = self.target.joinpath(variant.name)
+        if "topology.json" in variant.changed or self.topology is None:
+            topology = get_topology(variant.config.joinpath("topology.json"))
+            lab = render(variant.config, topology, self.data)
+            return sync(lab, target, self.link)
+
+        topology = self.topology
+        inputs = registry.get_inputs(variant.files)
+        changes = registry.get_changes(self.output.inputs, inputs)
+        devices = get_affected(topology, self.output.get_dependents(changes), changes)
+        for router in topology.routers:
+            router.clear_daemons()
+        if devices is None:
+            lab = render(variant.config, topology, self.data)
+            return sync(lab, target, self.link)
+        lab = self.output.clone()
+        lab.inputs = inputs
+        merge_daemons(variant.config, topology)
+        rerender(lab, self.data, topology, devices)
+        return sync(lab, target, self.link)
+
+    def run(self, jobs: int = 1) -> dict[str, Changes]:
+        global _forked
+        previous = output.shared_templates
+        # data/frr is read once for the base and all the variants
+        output.shared_templates = TemplateCache()
+        try:
+            self.render_base()
+            if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+                results = [self.render_variant(v) for v in self.variants]
+            else:
+                _forked = self
+                context = multiprocessing.get_context("fork")
+                with ProcessPoolExecutor(jobs, mp_context=context) as executor:
+                    results = list(
+                        executor.map(_render_forked, range(len(self.variants)))
+                    )
+        finally:
+            _forked = None
+            output.shared_templates = previous
+            self.folder.cleanup()
+        names = [variant.name for variant in self.variants]
+        return dict(zip(names, results))
+
+
+# the batch inherited by forked workers, with the base already rendered
+_forked: Batch | None = None
+
+
+def _render_forked(index: int) -> Changes:
+    assert _forked is not None
+    return _forked.render_variant(_forked.variants[index])
@@ -0,0 +1,394 @@
+from __future__ import annotations
+from pathlib import Path
+from daemon.dns.classes import DNSDaemon
+from daemon.dns.resolve import DNSReport, DNSSimulator
+from daemon.frr.frr import BACKBONE, BGP, FRR, OSPF, RIP, Area, FRRDaemon
+from topology.classes import Interface, Lan, Router, Topology
+from topology.parser import get_topology
+from topology.validate import ValidationError
+from topology.wizard import merge_daemons, validate_config
+
+try:
+    import numpy
+except ImportError:  # the pairs are checked with python integers
+    numpy = None  # type:ignore
+
+
+class Components:
+    # union-find over the routers, to group them in routing domains
+    def __init__(self) -> None:
+        self.parents: dict[Router, Router] = {}
+
+    def find(self, router: Router) -> Router:
+        root = self.parents.setdefault(router, router)
+        while root is not self.parents[root]:
+            root = self.parents[root]
+        while router is not root:
+            self.parents[router], router = root, self.parents[router]
+        return root
+
+    def union(self, left: Router, right: Router):
+        self.parents[self.find(left)] = self.find(right)
+
+    def get_groups(self) -> list[list[Router]]:
+        groups: dict[Router, list[Router]] = {}
+        for router in self.parents:
+            groups.setdefault(self.find(router), []).append(router)
+        return list(groups.values())
+
+
+class Report:
+    def __init__(self, devices: list[Router]) -> None:
+        self.devices = devices
+        self.warnings: list[str] = []
+        self.unreachable: dict[Router, list[Router]] = {}
+
+    def get_pairs(self) -> int:
+        return sum(len(targets) for targets in self.unreachable.values())
+
+    def is_ok(self) -> bool:
+        return not self.unreachable
+
+    def get_summary(self, limit: int = 8) -> str:
+        lines = [f"warning: {warning}" for warning in self.warnings]
+        for source, targets in self.unreachable.items():
+            names = " ".join(target.name for target in targets[:limit])
+            more = f" and {len(targets) - limit} more" if len(targets) > limit else ""
+            lines.append(f"{source.name} can't reach {names}{more}")
+        total = len(self.devices) * (len(self.devices) - 1)
+        lines.append(
+            f"{total - self.get_pairs()}/{total} pairs of devices can reach each other"
+        )
+        return "\n".join(lines)
+
+
+class Simulator:
+    # Predicts which lans each device has a route to, assuming that every
+    # protocol converges: routes are sets of lans kept as bits of an integer.
+    # RIP, OSPF and static routes are shared by the domains of routers that
+    # talk to each other (RIP ones up to 14 hops away), BGP routes by the ASes
+    # linked by eBGP sessions, and the protocols redistribute into each other
+    # like the generated frr.conf.
+    def __init__(self, topology: Topology, frr: FRR | None) -> None:
+        self.topology = topology
+        self.routers = topology.routers
+        self.lans = topology.get_lans()
+        self.bits: dict[Lan, int] = {lan: 1 << i for i, lan in enumerate(self.lans)}
+        self.connected: dict[Router, int] = {}
+        for router in self.routers:
+            self.connected[router] = self.get_mask(router.get_lans())
+        self.frr = frr
+        self.warnings: list[str] = []
+
+    def get_mask(self, lans: list[Lan]) -> int:
+        mask = 0
+        for lan in lans:
+            mask |= self.bits[lan]
+        return mask
+
+    def get_daemon(self, name: str) -> FRRDaemon | None:
+        return self.frr.get_daemon(name) if self.frr is not None else None
+
+    def get_members(self, daemon: FRRDaemon | None) -> set[Router]:
+        # the routers that really run the daemon, static ones don't
+        if daemon is None or self.frr is None:
+            return set()
+        return {
+            router
+            for router, daemons in self.frr.router_to_daemons.items()
+            if daemon in daemons
+        }
+
+    def get_domains(
+        self, members: set[Router], lans: set[Lan] | None = None
+    ) -> list[list[Router]]:
+        # members that share a lan (one of the given ones) talk to each other
+        components = Components()
+        for router in members:
+            components.find(router)
+            for interface in router.interfaces.values():
+                if lans is not None and interface.lan not in lans:
+                    continue
+                for neighbor in interface.lan.interfaces:
+                    if neighbor.router in members:
+                        components.union(router, neighbor.router)
+        return components.get_groups()
+
+    def simulate(self) -> dict[Router, int]:
+        rip_daemon = self.get_daemon("rip")
+        rip_members = self.get_members(rip_daemon)
+        rip_ranges = self.get_rip_ranges(rip_daemon)
+        rip_domains = [
+            (domain, rip_ranges) for domain in self.get_domains(rip_members)
+        ]
+        if isinstance(rip_daemon, RIP):
+            self.warnings.extend(rip_daemon.check_diameter())
+
+        ospf = self.get_daemon("ospf")
+        ospf_members = self.get_members(ospf)
+        ospf_lans: dict[Lan, Area] = ospf.lans if isinstance(ospf, OSPF) else {}
+        ospf_domains = self.get_domains(ospf_members, set(ospf_lans))
+
+        static = self.get_daemon("static")
+        static_members = self.get_members(static)
+        static_routes: dict[Router, int] = {}
+        for domain in self.get_domains(static_members):
+            mask = self.get_mask([lan for r in domain for lan in r.get_lans()])
+            for router in domain:
+                static_routes[router] = mask
+
+        bgp = self.get_daemon("bgp")
+        bgp_members = self.get_members(bgp)
+        as_groups = self.get_as_groups(bgp, bgp_members)
+
+        rip: dict[Router, int] = {}
+        ospf_routes: dict[Router, int] = {}
+        bgp_routes: dict[Router, int] = {}
+        # redistribution goes around in circles, so it runs until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for domain, ranges in rip_domains:
+                announced = {
+                    router: self.connected[router] | bgp_routes.get(router, 0)
+                    for router in domain
+                }
+                mask = 0
+                for router in domain:
+                    mask |= announced[router]
+                for router in domain:
+                    learned = mask
+                    if router in ranges:
+                        learned = 0
+                        for other in ranges[router]:
+                            learned |= announced[other]
+                    if rip.get(router) != learned:
+                        rip[router] = learned
+                        changed = True
+            for domain in ospf_domains:
+                for router, mask in self.get_ospf_routes(
+                    domain, ospf_lans, bgp_routes
+                ).items():
+                    if ospf_routes.get(router) != mask:
+                        ospf_routes[router] = mask
+                        changed = True
+            for group in as_groups:
+                mask = 0
+                for router in group:
+                    mask |= self.connected[router]
+                    mask |= rip.get(router, 0) | ospf_routes.get(router, 0)
+                for router in group:
+                    if bgp_routes.get(router) != mask:
+                        bgp_routes[router] = mask
+                        changed = True
+
+        routes: dict[Router, int] = {}
+        for router in self.routers:
+            routes[router] = (
+                self.connected[router]
+                | rip.get(router, 0)
+                | ospf_routes.get(router, 0)
+                | bgp_routes.get(router, 0)
+                | static_routes.get(router, 0)
+            )
+        return self.follow_defaults(routes)
+
+    def get_rip_ranges(self, rip: FRRDaemon | None) -> dict[Router, list[Router]]:
+        # the routers whose lans reach each router, for the routers that don't
+        # get the lans of their whole domain
+        if not isinstance(rip, RIP):
+            return {}
+        return rip.get_ranges()
+
+    def get_as_groups(self, bgp: FRRDaemon | None, members: set[Router]):
+        # ASes linked by an eBGP session learn the same routes, since the
+        # generated configs have no policies
+        if not isinstance(bgp, BGP):
+            return []
+        components = Components()
+        for as_routers in bgp.as_to_router.values():
+            routers = [router for router in as_routers if router in members]
+            for router in routers:
+                components.union(router, routers[0])
+        for router in members:
+            for neighbor in router.get_neighbors():
+                if neighbor.router in members:
+                    components.union(router, neighbor.router)
+        groups = components.get_groups()
+        if len(groups) > 1:
+            for group in groups:
+                ases = sorted({bgp.router_to_as[router] for router in group})
+                self.warnings.append(f"BGP island: AS {' '.join(ases)}")
+        return groups
+
+    def get_ospf_routes(
+        self,
+        domain: list[Router],
+        areas: dict[Lan, Area],
+        bgp_routes: dict[Router, int],
+    ) -> dict[Router, int]:
+        # areas attached to the backbone share their routes, the others only
+        # know their own; stub areas get the external routes by default route
+        router_areas: dict[Router, set[Area]] = {}
+        area_lans: dict[Area, int] = {}
+        external = 0
+        for router in domain:
+            external |= self.connected[router] | bgp_routes.get(router, 0)
+            router_areas[router] = set()
+            for lan in router.get_lans():
+                if lan in areas:
+                    area = areas[lan]
+                    router_areas[router].add(area)
+                    area_lans[area] = area_lans.get(area, 0) | self.bits[lan]
+        attached = {
+            area
+            for owned in router_areas.values()
+            if any(area.name == BACKBONE for area in owned)
+            for area in owned
+        }
+        inter = 0
+        for area in attached:
+            inter |= area_lans[area]
+
+        result: dict[Router, int] = {}
+        for router, owned in router_areas.items():
+            mask = 0
+            for area in owned:
+                mask |= area_lans[area]
+            if owned & attached:
+                mask |= inter | external
+            elif any(not area.is_stub for area in owned):
+                mask |= external
+            result[router] = mask
+        return result
+
+    def follow_defaults(self, routes: dict[Router, int]) -> dict[Router, int]:
+        # a device also reaches what its default gateway reaches
+        result: dict[Router, int] = {}
+        for router in self.routers:
+            mask = 0
+            seen: set[Router] = set()
+            current: Router | None = router
+            while current is not None and current not in seen:
+                seen.add(current)
+                mask |= routes[current]
+                gateway = current.default_router
+                if gateway is not None and not any(
+                    neighbor.router is gateway for neighbor in current.get_neighbors()
+                ):
+                    if current is router:
+                        self.warnings.append(
+                            f"{router.name} has {gateway.name} as default gateway"
+                            " but they share no lan"
+                        )
+                    gateway = None
+                current = gateway
+            result[router] = mask
+        return result
+
+
+def to_matrix(masks: list[int], size: int):
+    # one row of 0/1 for each mask, with a column for each lan
+    rows = (size + 7) // 8
+    data = b"".join(mask.to_bytes(rows, "little") for mask in masks)
+    bits = numpy.unpackbits(numpy.frombuffer(data, "uint8"), bitorder="little")
+    return bits.reshape(len(masks), rows * 8).astype("float32")
+
+
+def get_unreachable(
+    routers: list[Router],
+    routes: dict[Router, int],
+    connected: dict[Router, int],
+    size: int,
+) -> dict[Router, list[Router]]:
+    # a pair works if each one has a route to a lan of the other. Devices with
+    # the same routes and lans (like the hosts of a lan) are checked once
+    keys: dict[tuple[int, int], list[Router]] = {}
+    for router in routers:
+        keys.setdefault((routes[router], connected[router]), []).append(router)
+    classes = list(keys)
+
+    failed: list[tuple[int, int]] = []
+    if numpy is not None:
+        reach = to_matrix([reach for reach, _ in classes], size)
+        lans = to_matrix([own for _, own in classes], size)
+        forward = (reach @ lans.T) > 0
+        works = forward & forward.T
+        failed = [(int(i), int(j)) for i, j in zip(*numpy.nonzero(~works))]
+    else:
+        for i, (reach, own) in enumerate(classes):
+            for j, (other_reach, other_own) in enumerate(classes):
+                if not (reach & other_own and other_reach & own):
+                    failed.append((i, j))
+
+    result: dict[Router, list[Router]] = {}
+    for i, j in failed:
+        for source in keys[classes[i]]:
+            targets = [t for t in keys[classes[j]] if t is not source]
+            if targets:
+                result.setdefault(source, []).extend(targets)
+    # in the order of the topology
+    order = {router: i for i, router in enumerate(routers)}
+    return {
+        source: sorted(targets, key=order.__getitem__)
+        for source, targets in sorted(result.items(), key=lambda i: order[i[0]])
+    }
+
+
+def simulate(config: Path) -> tuple[Topology, Simulator, dict[Router, int]]:
+    validate_config(config)
+    topology = get_topology(config.joinpath("topology.json"))
+    merge_daemons(config, topology)
+    frr = next(
+        (
+            daemon
+            for router in topology.routers
+            for daemon in router.daemons
+            if isinstance(daemon, FRR)
+        ),
+        None,
+    )
+    simulator = Simulator(topology, frr)
+    routes = simulator.simulate()
+    return topology, simulator, routes
+
+
+def check(config: Path) -> Report:
+    topology, simulator, routes = simulate(config)
+    report = Report(topology.routers)
+    report.warnings = simulator.warnings
+    report.unreachable = get_unreachable(
+        topology.routers, routes, simulator.connected, len(simulator.lans)
+    )
+    return report
+
+
+def check_dns(config: Path) -> DNSReport:
+    # resolves the names of dns.json over the routes that check predicts
+    topology, simulator, routes = simulate(config)
+    dns = next(
+        (
+            daemon
+            for router in topology.routers
+            for daemon in router.daemons
+            if isinstance(daemon, DNSDaemon)
+        ),
+        None,
+    )
+    if dns is None:
+        raise ValidationError(["there is no dns.json to check"])
+    owners: dict[int, Interface] = {}
+    for router in topology.routers:
+        for interface in router.interfaces.values():
+            owners[interface.ip] = interface
+
+    def reaches(source: Router, ip: int) -> bool:
+        # the queries get there and the answers come back
+        interface = owners.get(ip)
+        if interface is None:
+            return False
+        forward = routes[source] & simulator.bits[interface.lan]
+        return bool(forward and routes[interface.router] & simulator.connected[source])
+
+    resolver = DNSSimulator(dns, reaches)
+    return resolver.run()
@@ -1,16 +1,44 @@
 from __future__ import annotations
-import daemon.classes
+from typing import TYPE_CHECKING
+from topology.address import format_ip, get_mask, parse_prefix
+
+if TYPE_CHECKING:
+    import daemon.classes
 
 
 class Lan:
+    # addresses are kept as integers, the strings are built when rendering
+    __slots__ = ("name", "ip", "prefixlen", "interfaces")
+
     def __init__(self, name: str, full_address: str) -> None:
         self.name = name
-        self.full_address = full_address
-        self.address, _, self.netmask = full_address.partition("/")
-        self.stripped_address = ".".join(self.address.split(".")[:-1])
+        self.ip, self.prefixlen = parse_prefix(full_address)
         self.interfaces: list[Interface] = []
 
+    @property
+    def address(self) -> str:
+        return format_ip(self.ip)
+
+    @property
+    def netmask(self) -> str:
+        return str(self.prefixlen)
+
+    @property
+    def full_address(self) -> str:
+        return f"{format_ip(self.ip)}/{self.prefixlen}"
+
+    @property
+    def mask(self) -> int:
+        return get_mask(self.prefixlen)
+
+    @property
+    def network(self) -> int:
+        return self.ip & self.mask
+
     def add_interface(self, inter: Interface):
+        # the routers already on this lan get a new neighbor
+        for interface in self.interfaces:
+            interface.router.invalidate_neighbors()
         self.interfaces.append(inter)
 
     def __repr__(self) -> str:
@@ -18,23 +46,43 @@ class Lan:
 
 
 class Router:
+    __slots__ = (
+        "interfaces",
+        "name",
+        "daemons",
+        "router_ip",
+        "default_router",
+        "topology",
+        "neighbors",
+    )
+
     def __init__(self, name: str) -> None:
         self.interfaces: dict[str, Interface] = {}
         self.name = name
         self.daemons: list[daemon.classes.Daemon] = []
-        self.router_id: str | None = None
-        self.default_router = None
+        self.router_ip: int | None = None
+        self.default_router: Router | None = None
+        self.topology: Topology | None = None
+        self.neighbors: list[Interface] | None = None
 
     def add_interface(self, interface: Interface):
         self.interfaces[interface.name] = interface
-        if self.router_id is None:
-            self.router_id = interface.address
-        else:
-            self.router_id = max(self.router_id, interface.address)
+        self.invalidate_neighbors()
+        if self.topology is not None:
+            self.topology.add_lan(interface.lan)
+        if self.router_ip is None or interface.ip > self.router_ip:
+            self.router_ip = interface.ip
+
+    @property
+    def router_id(self) -> str | None:
+        return None if self.router_ip is None else format_ip(self.router_ip)
 
     def add_daemon(self, daemon: daemon.classes.Daemon):
         self.daemons.append(daemon)
 
+    def clear_daemons(self):
+        self.daemons = []
+
     def set_default_router(self, rtr: Router):
         self.default_router = rtr
 
@@ -47,13 +95,19 @@ class Router:
     def get_interface(self, name: str) -> Interface:
         return self.interfaces[name]
 
+    def invalidate_neighbors(self):
+        self.neighbors = None
+
     def get_neighbors(self) -> list[Interface]:
-        res: list[Interface] = []
-        for lan in self.get_lans():
-            for interface in lan.interfaces:
-                if interface.router is not self:
-                    res.append(interface)
-        return res
+        # computed once and kept until an interface is added to one of our lans
+        if self.neighbors is None:
+            res: list[Interface] = []
+            for lan in self.get_lans():
+                for interface in lan.interfaces:
+                    if interface.router is not self:
+                        res.append(interface)
+            self.neighbors = res
+        return self.neighbors
 
     def __repr__(self) -> str:
         interfaces = ""
@@ -64,16 +118,28 @@ class Router:
 
 
 class Interface:
-    def __init__(self, name: str, byte: str, lan: Lan, router: Router) -> None:
+    __slots__ = ("name", "ip", "lan", "router")
+
+    def __init__(self, name: str, ip: int, lan: Lan, router: Router) -> None:
         self.name = name
-        self.number = name[-1]
-        self.address = lan.stripped_address + "." + byte
-        self.full_address = self.address + "/" + lan.netmask
+        self.ip = ip
         self.lan = lan
         self.router: Router = router
         router.add_interface(self)
         lan.add_interface(self)
 
+    @property
+    def number(self) -> str:
+        return self.name.removeprefix("eth")
+
+    @property
+    def address(self) -> str:
+        return format_ip(self.ip)
+
+    @property
+    def full_address(self) -> str:
+        return f"{format_ip(self.ip)}/{self.lan.prefixlen}"
+
     def add_router(self, router: Router):
         self.router = router
 
@@ -82,25 +148,32 @@ class Interface:
 
 
 class Topology:
+    __slots__ = ("routers", "router_map", "lan_map")
+
     def __init__(self) -> None:
         self.routers: list[Router] = []
+        self.router_map: dict[str, Router] = {}
+        self.lan_map: dict[str, Lan] = {}
 
     def add_router(self, router: Router):
         self.routers.append(router)
+        self.router_map[router.name] = router
+        router.topology = self
+        for lan in router.get_lans():
+            self.add_lan(lan)
+
+    def add_lan(self, lan: Lan):
+        if lan.name not in self.lan_map:
+            self.lan_map[lan.name] = lan
 
     def get_lans(self) -> list[Lan]:
-        lans: list[Lan] = []
-        for router in self.routers:
-            lans.extend(router.get_lans())
-        return lans
+        return list(self.lan_map.values())
 
     def get_lan_map(self) -> dict[str, Lan]:
-        return {lan.name: lan for lan in self.get_lans()}
+        return self.lan_map
 
     def get_router_map(self) -> dict[str, Router]:
-        return {router.name: router for router in self.routers}
+        return self.router_map
 
     def get_router_by_name(self, name: str) -> Router | None:
-        for router in self.routers:
-            if router.name == name:
-                return router
+        return self.router_map.get(name)
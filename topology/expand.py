@@ -0,0 +1,167 @@
+from __future__ import annotations
+import ast
+import operator
+import re
+from functools import lru_cache, partial
+from itertools import product
+from typing import Any, Callable, Iterator
+from topology.address import format_ip, get_mask, parse_prefix
+
+# {1..50} is a range, {$1+1} is computed from the values of the ranges, in the
+# order they appear in the router name, then in the interface name
+FIELD = re.compile(r"\{([^{}]*)\}")
+RANGE = re.compile(r"\s*(-?\d+)\s*\.\.\s*(-?\d+)\s*")
+VARIABLE = re.compile(r"\$(\d+)")
+
+OPERATORS: dict[type, Callable[[int, int], int]] = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression: str) -> Callable[[tuple[int, ...]], int]:
+    # integer arithmetic only, the json is not trusted with eval. Each
+    # expression is parsed once and then computed for every name
+    def walk(node: ast.AST) -> Callable[[tuple[int, ...]], int]:
+        if isinstance(node, ast.Expression):
+            return walk(node.body)
+        if isinstance(node, ast.Constant) and type(node.value) is int:
+            constant = node.value
+            return lambda values: constant
+        if isinstance(node, ast.Name) and node.id in variables:
+            index = int(node.id[1:])
+
+            def variable(values: tuple[int, ...]) -> int:
+                if not 1 <= index <= len(values):
+                    raise ValueError(f"${index} is not defined in {{{expression}}}")
+                return values[index - 1]
+
+            return variable
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            operand = walk(node.operand)
+            return lambda values: -operand(values)
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            apply = OPERATORS[type(node.op)]
+            left, right = walk(node.left), walk(node.right)
+            return lambda values: apply(left(values), right(values))
+        raise ValueError(f"{{{expression}}} is not a valid expression")
+
+    # only the names that $<n> become are variables, {x1} is not $1
+    if "_" in expression:
+        raise ValueError(f"{{{expression}}} is not a valid expression")
+    variables = {f"_{index}" for index in VARIABLE.findall(expression)}
+    try:
+        tree = ast.parse(VARIABLE.sub(r"_\1", expression), mode="eval")
+    except SyntaxError:
+        raise ValueError(f"{{{expression}}} is not a valid expression")
+    return walk(tree)
+
+
+def evaluate(
+    expression: Callable[[tuple[int, ...]], int], template: str, values: tuple[int, ...]
+) -> int:
+    try:
+        return expression(values)
+    except ArithmeticError as e:  # like {$1//0}
+        raise ValueError(f"{template}: {e}")
+
+
+@lru_cache(maxsize=None)
+def compile_template(text: str) -> tuple[list[Any], list[range]]:
+    # the text split in strings, positions of ranges (ints) and expressions
+    parts: list[Any] = []
+    ranges: list[range] = []
+    position = 0
+    for match in FIELD.finditer(text):
+        parts.append(text[position : match.start()])
+        position = match.end()
+        bounds = RANGE.fullmatch(match.group(1))
+        if bounds is None:
+            parts.append(partial(evaluate, compile_expression(match.group(1)), text))
+            continue
+        start, stop = int(bounds.group(1)), int(bounds.group(2))
+        parts.append(len(ranges))
+        ranges.append(range(start, stop + 1) if start <= stop else range(0))
+    parts.append(text[position:])
+    return parts, ranges
+
+
+def fill(parts: list[Any], combination: tuple[int, ...], values: tuple[int, ...]):
+    text: list[str] = []
+    for part in parts:
+        if type(part) is str:
+            text.append(part)
+        elif type(part) is int:
+            text.append(str(combination[part]))
+        else:
+            text.append(str(part(values)))
+    return "".join(text)
+
+
+def substitute(text: str, values: tuple[int, ...]) -> str:
+    if "{" not in text:
+        return text
+    parts, _ = compile_template(text)
+    return fill(parts, (), values)
+
+
+def expand(
+    template: str, values: tuple[int, ...] = ()
+) -> Iterator[tuple[str, tuple[int, ...]]]:
+    # yields every name of the template, with the values of all the ranges
+    # so far, without building the whole list
+    if "{" not in template:
+        yield template, values
+        return
+    parts, ranges = compile_template(template)
+    for combination in product(*ranges):
+        current = values + combination
+        yield fill(parts, combination, current), current
+
+
+def expand_lans(lans: dict[str, str]) -> Iterator[tuple[str, str]]:
+    # "<prefix>" for a single lan, "<pool> /<length>" to number the lans of
+    # a template with consecutive subnets of the pool
+    for template, address in lans.items():
+        for count, (name, values) in enumerate(expand(template)):
+            words = substitute(address, values).split()
+            if len(words) == 2 and words[1].startswith("/"):
+                yield name, take_subnet(words[0], int(words[1][1:]), count)
+            else:
+                yield name, " ".join(words)
+
+
+def take_subnet(pool: str, prefixlen: int, index: int) -> str:
+    ip, length = parse_prefix(pool)
+    if prefixlen < length or prefixlen > 32:
+        raise ValueError(f"/{prefixlen} subnets don't fit in {pool}")
+    if index >= 1 << (prefixlen - length):
+        raise ValueError(f"{pool} has no room for {index + 1} /{prefixlen} lans")
+    network = (ip & get_mask(length)) + (index << (32 - prefixlen))
+    return f"{format_ip(network)}/{prefixlen}"
+
+
+def expand_routers(
+    routers: dict[str, dict[str, str]]
+) -> Iterator[tuple[str, Iterator[tuple[str, str]]]]:
+    for template, interfaces in routers.items():
+        for name, values in expand(template):
+            yield name, expand_interfaces(interfaces, values)
+
+
+def expand_interfaces(
+    interfaces: dict[str, str], values: tuple[int, ...]
+) -> Iterator[tuple[str, str]]:
+    for template, data in interfaces.items():
+        for name, current in expand(template, values):
+            yield name, substitute(data, current)
+
+
+def expand_lines(lines: list[str]) -> Iterator[str]:
+    for line in lines:
+        for text, _ in expand(line):
+            yield text
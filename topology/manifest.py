@@ -0,0 +1,231 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterable
+from topology import stats
+from topology.output import BASE_TAG, LabOutput, find_dependents, materialize
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_device(relative: str) -> str | None:
+    # "<router>/..." and "<router>.startup" belong to a device, lab.conf to the lab
+    head, sep, _ = relative.partition("/")
+    if sep:
+        return head
+    if head.endswith(".startup"):
+        return head.removesuffix(".startup")
+    return None
+
+
+def in_devices(devices: set[str], relative: str) -> bool:
+    return get_device(relative) in devices
+
+
+class Manifest:
+    # For every generated file: its hash, the tags of the daemons that wrote it,
+    # the config entries it depends on and, for the files shared between tags,
+    # the content of each part so that one tag can be rendered again alone.
+    # The hashes of the config entries tell which ones changed on the next run
+    def __init__(self, hashes: dict[str, str] | None = None) -> None:
+        self.hashes: dict[str, str] = hashes if hashes is not None else {}
+        self.tags: dict[str, list[str]] = {}
+        self.sources: dict[str, list[str]] = {}
+        self.parts: dict[str, dict[str, str]] = {}
+        self.inputs: dict[str, dict[str, str]] = {}
+
+    def add(self, relative: str, digest: str, output: LabOutput):
+        self.hashes[relative] = digest
+        self.tags[relative] = output.get_tags(relative)
+        self.sources[relative] = output.get_sources(relative)
+        if len(self.tags[relative]) > 1 or BASE_TAG in self.tags[relative]:
+            self.parts[relative] = output.get_parts(relative)
+
+    def keep(self, relative: str, old: Manifest):
+        self.hashes[relative] = old.hashes[relative]
+        for attribute in ("tags", "sources", "parts"):
+            entries = getattr(old, attribute)
+            if relative in entries:
+                getattr(self, attribute)[relative] = entries[relative]
+
+    def get_dependents(self, changed: Iterable[str]) -> list[str]:
+        return find_dependents(self.sources, changed)
+
+    @staticmethod
+    def load(folder: Path) -> Manifest | None:
+        path = folder.joinpath(MANIFEST_NAME)
+        if not path.exists():
+            return None
+        with path.open("r") as f:
+            data = json.load(f)
+        if "files" not in data:
+            # manifests without tags only have the hashes
+            return Manifest(data)
+        manifest = Manifest()
+        table: list[str] = data.get("sources", [])
+        groups = [[table[i] for i in group] for group in data.get("groups", [[]])]
+        manifest.inputs = data.get("inputs", {})
+        for relative, entry in data["files"].items():
+            manifest.hashes[relative] = entry["hash"]
+            manifest.tags[relative] = entry["tags"]
+            manifest.sources[relative] = groups[entry.get("sources", 0)]
+            if "parts" in entry:
+                manifest.parts[relative] = entry["parts"]
+        return manifest
+
+    def save(self, folder: Path):
+        files: dict[str, dict[str, Any]] = {}
+        # the sources and their groups are repeated by many files, like all the
+        # files of a daemon on a router, so each one is stored once
+        table: dict[str, int] = {}
+        groups: dict[tuple[str, ...], int] = {(): 0}
+        for relative in sorted(self.hashes):
+            group = tuple(self.sources.get(relative, []))
+            if group not in groups:
+                groups[group] = len(groups)
+                for source in group:
+                    table.setdefault(source, len(table))
+            entry: dict[str, Any] = {
+                "hash": self.hashes[relative],
+                "tags": self.tags.get(relative, []),
+                "sources": groups[group],
+            }
+            if relative in self.parts:
+                entry["parts"] = self.parts[relative]
+            files[relative] = entry
+        # without indentation the C encoder is used, big labs have big manifests
+        with folder.joinpath(MANIFEST_NAME).open("w") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "files": files,
+                        "sources": list(table),
+                        "groups": [[table[s] for s in group] for group in groups],
+                        "inputs": self.inputs,
+                    }
+                )
+            )
+
+
+class Changes:
+    def __init__(self) -> None:
+        self.written: list[str] = []
+        self.removed: list[str] = []
+
+    def get_devices(self) -> set[str]:
+        devices: set[str] = set()
+        for relative in self.written + self.removed:
+            device = get_device(relative)
+            if device is not None:
+                devices.add(device)
+        return devices
+
+    def lab_changed(self) -> bool:
+        return any(get_device(rel) is None for rel in self.written + self.removed)
+
+    def get_summary(self) -> str:
+        lines: list[str] = []
+        if self.lab_changed():
+            lines.append("lab.conf changed, restart the whole lab")
+        devices = self.get_devices()
+        if devices:
+            lines.append("Changed devices: " + " ".join(sorted(devices)))
+        else:
+            lines.append("Nothing changed")
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return f"(written: {len(self.written)}, removed: {len(self.removed)})"
+
+
+def sync(
+    output: LabOutput,
+    target: Path,
+    link: bool = False,
+    scope: Callable[[str], bool] | None = None,
+    devices: set[str] | None = None,
+) -> Changes:
+    # writes the files of output into target, skipping the ones whose hash
+    # matches the manifest of the previous run and deleting the stale ones.
+    # With a scope, only the files it accepts are looked at and the others are
+    # kept as they are. With devices, only the files and the directories of
+    # those devices are looked at.
+    changes = Changes()
+    old = Manifest.load(target) if target.exists() else None
+    if old is None:
+        scope = None
+        devices = None
+        # without a manifest we can't tell our files apart, so start over
+        if target.exists():
+            shutil.rmtree(target.as_posix())
+        old = Manifest()
+    target.mkdir(parents=True, exist_ok=True)
+
+    directories = output.get_directories(devices)
+    roots = [target]
+    if devices is not None:
+        roots = [target.joinpath(device) for device in sorted(devices)]
+        if scope is None:
+            scope = partial(in_devices, devices)
+    for directory in sorted(directories):
+        target.joinpath(directory).mkdir(exist_ok=True)
+
+    new = Manifest()
+    new.inputs = output.inputs
+    paths = output.get_paths()
+    if scope is not None:
+        paths = [path for path in paths if scope(path)]
+        for relative in old.hashes:
+            if not scope(relative):
+                new.keep(relative, old)
+    for relative in paths:
+        template = output.get_template_file(relative)
+        if template is not None:
+            digest = template.digest
+            size = len(template.text.encode())
+        else:
+            content = output.render(relative)
+            digest = hash_bytes(content)
+            size = len(content)
+        new.add(relative, digest, output)
+        destination = target.joinpath(relative)
+        unchanged = old.hashes.get(relative) == digest and destination.exists()
+        stats.add_file(get_device(relative) or "lab", size, not unchanged)
+        if unchanged:
+            continue
+        if template is not None:
+            with stats.timer("copy", template.root.as_posix()):
+                materialize(template, destination, link)
+        else:
+            with destination.open("wb") as f:
+                f.write(content)
+        changes.written.append(relative)
+
+    for relative in old.hashes:
+        if relative not in new.hashes:
+            target.joinpath(relative).unlink(missing_ok=True)
+            changes.removed.append(relative)
+
+    # drops the directories left empty by the removed files
+    for top in roots:
+        for root, dirs, _ in os.walk(top, topdown=False):
+            for name in dirs:
+                path = Path(root, name)
+                if path.relative_to(target).as_posix() not in directories:
+                    try:
+                        path.rmdir()
+                    except OSError:
+                        pass
+
+    new.save(target)
+    changes.written.sort()
+    changes.removed.sort()
+    return changes
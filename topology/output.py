@@ -0,0 +1,315 @@
+from __future__ import annotations
+import hashlib
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Iterator, Union
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None  # type:ignore
+
+# ioctl that makes a file share the blocks of another one (btrfs, xfs...)
+FICLONE = 0x40049409
+
+
+class TemplateFile:
+    __slots__ = ("root", "source", "text", "digest")
+
+    def __init__(self, root: Path, source: Path) -> None:
+        # the directory of the template, like data/frr
+        self.root = root
+        self.source = source
+        self.text = source.read_text()
+        self.digest = hashlib.sha256(self.text.encode()).hexdigest()
+
+
+class Template:
+    # A directory read once and shared by every device that copies it
+    def __init__(self, source: Path) -> None:
+        self.source = source
+        self.files: dict[str, TemplateFile] = {
+            file.relative_to(source).as_posix(): TemplateFile(source, file)
+            for file in sorted(source.rglob("*"))
+            if file.is_file()
+        }
+
+
+class TemplateCache:
+    def __init__(self) -> None:
+        self.templates: dict[Path, Template] = {}
+        self.lock = Lock()
+
+    def get(self, source: Path) -> Template:
+        with self.lock:
+            if source not in self.templates:
+                self.templates[source] = Template(source)
+            return self.templates[source]
+
+
+# when set, every run in this process reads the templates from this cache
+shared_templates: TemplateCache | None = None
+
+
+def get_template_cache() -> TemplateCache:
+    return shared_templates if shared_templates is not None else TemplateCache()
+
+
+def materialize(template: TemplateFile, destination: Path, link: bool):
+    # hardlinks or reflinks the template file, copying it only as a last resort
+    destination.unlink(missing_ok=True)
+    if link:
+        try:
+            os.link(template.source, destination)
+            return
+        except OSError:
+            pass
+    if fcntl is not None:
+        try:
+            with template.source.open("rb") as src, destination.open("wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    with destination.open("wb") as f:
+        f.write(template.text.encode())
+
+
+Chunk = Union[str, Iterable[str], TemplateFile]
+
+# tag of the files made from topology.json alone, that the daemons append to
+BASE_TAG = "topology"
+
+
+def get_scopes(source: str) -> list[str]:
+    # "ospf.json:costs/r1" is inside "ospf.json:costs", that is inside "ospf.json"
+    scopes = [source]
+    while True:
+        cut = max(source.rfind("/"), source.rfind(":"))
+        if cut < 0:
+            return scopes
+        source = source[:cut]
+        scopes.append(source)
+
+
+def find_dependents(
+    sources: dict[str, Iterable[str]], changed: Iterable[str]
+) -> list[str]:
+    # the files with a source that is, contains or is inside a changed entry.
+    # Many files share their sources, so each source is looked at once
+    changed = set(changed)
+    containing = {scope for entry in changed for scope in get_scopes(entry)}
+    inside = tuple(entry + sep for entry in changed for sep in "/:")
+    hit = {
+        source
+        for source in set().union(*sources.values())
+        if source in containing or source.startswith(inside)
+    }
+    if not hit:
+        return []
+    return [
+        path
+        for path, file_sources in sources.items()
+        if not hit.isdisjoint(file_sources)
+    ]
+
+
+class LabOutput:
+    # Collects the content of every file of the lab in memory, either as strings
+    # or as lazy chunk generators, so that each file is written exactly once.
+    # The content of a file is split in parts, one for each tag (the daemon that
+    # wrote it), and every file records the config entries it depends on.
+    def __init__(self) -> None:
+        self.files: dict[str, dict[str, list[Chunk]]] = {}
+        self.sources: dict[str, set[str]] = {}
+        self.directories: set[str] = set()
+        self.tag = ""
+        self.active: list[str] = []
+        # hashes of the entries of the config files the lab is made from
+        self.inputs: dict[str, dict[str, str]] = {}
+
+    @staticmethod
+    def key(path: str | Path) -> str:
+        return Path(path).as_posix()
+
+    @contextmanager
+    def tagged(self, tag: str) -> Iterator[None]:
+        previous, self.tag = self.tag, tag
+        try:
+            yield
+        finally:
+            self.tag = previous
+
+    @contextmanager
+    def depends_on(self, *sources: str) -> Iterator[None]:
+        # sources are entries of the config files, like "dns.json:zones/it",
+        # or whole parts of them like "static.json" and "ospf.json:costs"
+        self.active.extend(sources)
+        try:
+            yield
+        finally:
+            del self.active[len(self.active) - len(sources) :]
+
+    def touch(self, key: str):
+        if self.active:
+            self.sources.setdefault(key, set()).update(self.active)
+
+    def add_chunk(self, path: str | Path, chunk: Chunk):
+        key = self.key(path)
+        self.files.setdefault(key, {}).setdefault(self.tag, []).append(chunk)
+        self.touch(key)
+
+    def mkdir(self, path: str | Path):
+        self.directories.add(self.key(path))
+
+    def write(self, path: str | Path, content: str | Iterable[str]):
+        # like extend, the chunks of an iterable are consumed when rendered
+        key = self.key(path)
+        self.files[key] = {self.tag: [content]}
+        self.sources.pop(key, None)
+        self.touch(key)
+
+    def append(self, path: str | Path, content: str):
+        self.add_chunk(path, content)
+
+    def extend(self, path: str | Path, chunks: Iterable[str]):
+        # chunks are consumed only when the file is rendered
+        self.add_chunk(path, chunks)
+
+    def add_template(self, template: Template, path: str | Path):
+        # files that are never appended to are linked to the template when written
+        for relative, file in template.files.items():
+            key = self.key(Path(path, relative))
+            self.files[key] = {self.tag: [file]}
+            self.sources.pop(key, None)
+            self.touch(key)
+
+    def get_template_file(self, path: str | Path) -> TemplateFile | None:
+        parts = self.files[self.key(path)]
+        if len(parts) == 1:
+            chunks = next(iter(parts.values()))
+            if len(chunks) == 1 and isinstance(chunks[0], TemplateFile):
+                return chunks[0]
+        return None
+
+    def get_tags(self, path: str | Path) -> list[str]:
+        return [tag for tag, chunks in self.files[self.key(path)].items() if chunks]
+
+    def get_sources(self, path: str | Path) -> list[str]:
+        return sorted(self.sources.get(self.key(path), ()))
+
+    def get_dependents(self, changed: Iterable[str]) -> list[str]:
+        return find_dependents(self.sources, changed)
+
+    def get_parts(self, path: str | Path) -> dict[str, str]:
+        self.render(path)
+        return {
+            tag: "".join(self.iter_part(chunks))
+            for tag, chunks in self.files[self.key(path)].items()
+        }
+
+    def set_parts(self, path: str | Path, parts: dict[str, str], sources: list[str]):
+        # empty parts keep their place for the tags that are rendered again
+        key = self.key(path)
+        self.files[key] = {tag: [text] if text else [] for tag, text in parts.items()}
+        self.sources[key] = set(sources)
+
+    def remove_devices(self, names: Iterable[str]):
+        # drops <name>.startup and everything under <name>/, in a single pass
+        names = set(names)
+
+        def owned(path: str) -> bool:
+            first, slash, _ = path.partition("/")
+            if slash:
+                return first in names
+            return path.endswith(".startup") and path[: -len(".startup")] in names
+
+        for path in [p for p in self.files if owned(p)]:
+            del self.files[path]
+            self.sources.pop(path, None)
+        self.directories = {d for d in self.directories if not owned(d + "/")}
+
+    def exists(self, path: str | Path) -> bool:
+        return self.key(path) in self.files
+
+    def get_paths(self) -> list[str]:
+        return list(self.files)
+
+    def get_directories(self, devices: set[str] | None = None) -> set[str]:
+        # with devices, only the directories of those devices
+        def wanted(path: str) -> bool:
+            return devices is None or path.partition("/")[0] in devices
+
+        directories = {d for d in self.directories if wanted(d)}
+        for path in self.files:
+            if not wanted(path):
+                continue
+            parent = Path(path).parent
+            while parent != Path("."):
+                directories.add(parent.as_posix())
+                parent = parent.parent
+        return directories
+
+    @staticmethod
+    def iter_part(chunks: list[Chunk]) -> Iterator[str]:
+        for item in chunks:
+            if isinstance(item, str):
+                yield item
+            elif isinstance(item, TemplateFile):
+                yield item.text
+            else:
+                yield from item
+
+    def iter_chunks(self, path: str | Path) -> Iterator[str]:
+        for chunks in self.files[self.key(path)].values():
+            yield from self.iter_part(chunks)
+
+    def render(self, path: str | Path) -> bytes:
+        key = self.key(path)
+        if self.get_template_file(key) is not None:
+            return "".join(self.iter_chunks(key)).encode()
+        # generators can only be consumed once
+        parts = {
+            tag: "".join(self.iter_part(chunks))
+            for tag, chunks in self.files[key].items()
+        }
+        self.files[key] = {tag: [text] if text else [] for tag, text in parts.items()}
+        return "".join(parts.values()).encode()
+
+    def freeze(self):
+        for path in self.files:
+            self.render(path)
+
+    def select(self, paths: Iterable[str | Path]) -> LabOutput:
+        result = LabOutput()
+        for path in paths:
+            key = self.key(path)
+            if key in self.files:
+                result.files[key] = {
+                    tag: list(chunks) for tag, chunks in self.files[key].items()
+                }
+                if key in self.sources:
+                    result.sources[key] = set(self.sources[key])
+        return result
+
+    def clone(self) -> LabOutput:
+        # the chunks are shared, so the output should be frozen before
+        result = LabOutput()
+        result.files = {
+            path: {tag: list(chunks) for tag, chunks in parts.items()}
+            for path, parts in self.files.items()
+        }
+        result.sources = {path: set(sources) for path, sources in self.sources.items()}
+        result.directories = set(self.directories)
+        result.inputs = dict(self.inputs)
+        return result
+
+    def merge(self, other: LabOutput):
+        # files in other replace the ones with the same path
+        self.files.update(other.files)
+        for path in other.files:
+            self.sources.pop(path, None)
+        self.sources.update(other.sources)
+        self.directories.update(other.directories)
@@ -2,6 +2,8 @@ from pathlib import Path
 import json
 from typing import Any
 from topology.classes import Router, Lan, Interface, Topology
+from topology.allocate import Addressing
+from topology.expand import expand_lines, expand_routers
 
 
 def parse_json(path: Path):
@@ -10,9 +12,12 @@ def parse_json(path: Path):
 
 
 def parse_topology(topology: dict[str, Any]) -> Topology:
-    lans: dict[str, str] = topology["lans"]
+    # the names can be templates like "as{1..50}r{1..4}", see topology.expand,
+    # and the addresses "auto", see topology.allocate
+    addressing = Addressing(topology)
     parsed_lans: dict[str, Lan] = {
-        name: Lan(name.upper(), full_address) for name, full_address in lans.items()
+        name.upper(): Lan(name.upper(), full_address)
+        for name, full_address in addressing.lans.items()
     }
     routers: dict[str, dict[str, str]] = topology["routers"]
     defaults: dict[str, list[str]] = (
@@ -20,18 +25,18 @@ def parse_topology(topology: dict[str, Any]) -> Topology:
     )
     result: Topology = Topology()
 
-    for name, interfaces in routers.items():
+    for name, interfaces in expand_routers(routers):
         router = Router(name)
 
-        for interface_name, interface_data in interfaces.items():
+        for interface_name, interface_data in interfaces:
             split_data = interface_data.split()
-            byte = split_data[0]
             lan = parsed_lans[split_data[1].upper()]
-            Interface(interface_name, byte, lan, router)
+            ip = addressing.get_ip(lan.name, split_data[0])
+            Interface(interface_name, ip, lan, router)
 
         result.add_router(router)
 
-    for line in defaults:
+    for line in expand_lines(defaults):
         client, deflt = [word.strip() for word in line.split()]
         client_rtr: Router = result.get_router_by_name(client)
         deflt_rtr = result.get_router_by_name(deflt)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Iterator
+
+
+class DeviceStats:
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.written_files = 0
+        self.written_bytes = 0
+
+    def to_json(self) -> dict[str, int]:
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "written_files": self.written_files,
+            "written_bytes": self.written_bytes,
+        }
+
+
+class Stats:
+    # Times are grouped by kind ("phase", "configurer", "copy") and name, and
+    # are inclusive: FRRConfigurer also counts the time of the FRR daemons
+    def __init__(self) -> None:
+        self.times: dict[str, dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+        self.calls: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.devices: dict[str, DeviceStats] = defaultdict(DeviceStats)
+        self.lock = Lock()
+
+    def add_time(self, kind: str, name: str, seconds: float, calls: int = 1):
+        with self.lock:
+            self.times[kind][name] += seconds
+            self.calls[kind][name] += calls
+
+    @contextmanager
+    def timer(self, kind: str, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(kind, name, time.perf_counter() - start)
+
+    def add_file(self, device: str, size: int, written: bool):
+        with self.lock:
+            stats = self.devices[device]
+            stats.files += 1
+            stats.bytes += size
+            if written:
+                stats.written_files += 1
+                stats.written_bytes += size
+
+    def get_times(self) -> dict[str, dict[str, list[float]]]:
+        return {
+            kind: {
+                name: [seconds, self.calls[kind][name]]
+                for name, seconds in names.items()
+            }
+            for kind, names in self.times.items()
+        }
+
+    def merge_times(self, times: dict[str, dict[str, list[float]]]):
+        for kind, names in times.items():
+            for name, (seconds, calls) in names.items():
+                self.add_time(kind, name, seconds, int(calls))
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "times": {
+                kind: {
+                    name: {"seconds": seconds, "calls": calls}
+                    for name, (seconds, calls) in names.items()
+                }
+                for kind, names in self.get_times().items()
+            },
+            "devices": {
+                name: stats.to_json() for name, stats in sorted(self.devices.items())
+            },
+        }
+
+    def get_summary(self, top: int = 10) -> str:
+        lines: list[str] = []
+        for kind, names in self.get_times().items():
+            lines.append(f"{kind}:")
+            for name, (seconds, calls) in names.items():
+                lines.append(f"    {name:<24}{seconds:>10.4f} s{int(calls):>8} calls")
+        files = sum(stats.files for stats in self.devices.values())
+        size = sum(stats.bytes for stats in self.devices.values())
+        written = sum(stats.written_files for stats in self.devices.values())
+        written_size = sum(stats.written_bytes for stats in self.devices.values())
+        lines.append(f"files: {files} generated ({size} bytes)")
+        lines.append(f"       {written} written ({written_size} bytes)")
+        biggest = sorted(self.devices.items(), key=lambda item: -item[1].bytes)[:top]
+        if biggest:
+            lines.append("biggest devices:")
+            for name, stats in biggest:
+                lines.append(
+                    f"    {name:<24}{stats.files:>6} files{stats.bytes:>10} bytes"
+                )
+        return "\n".join(lines)
+
+
+# the stats of the current run, None when they are not collected
+recorder: Stats | None = None
+
+
+def enable() -> Stats:
+    global recorder
+    recorder = Stats()
+    return recorder
+
+
+@contextmanager
+def timer(kind: str, name: str) -> Iterator[None]:
+    if recorder is None:
+        yield
+    else:
+        with recorder.timer(kind, name):
+            yield
+
+
+def add_file(device: str, size: int, written: bool):
+    if recorder is not None:
+        recorder.add_file(device, size, written)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+from typing import Any
+from topology.address import format_ip, get_mask, parse_prefix
+from topology.allocate import Addressing
+from topology.expand import expand_lines, expand_routers
+
+
+class ValidationError(ValueError):
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+class Index:
+    # Names and addresses of the topology, read from the json without building
+    # it, so that every config file can be checked even when another one is wrong
+    def __init__(self) -> None:
+        self.lans: dict[str, tuple[int, int]] = {}
+        self.interfaces: dict[str, set[str]] = {}
+        self.errors: list[str] = []
+
+    def error(self, message: str):
+        self.errors.append(message)
+
+    def has_router(self, name: str) -> bool:
+        return name in self.interfaces
+
+    def has_lan(self, name: str) -> bool:
+        return name in self.lans
+
+    def has_interface(self, router: str, interface: str) -> bool:
+        return interface in self.interfaces.get(router, ())
+
+    def check_routers(self, where: str, names: list[str]):
+        for name in names:
+            if not self.has_router(name):
+                self.error(f"{where}: the router {name} does not exist")
+
+    def check_interface(self, where: str, router: str, interface: str):
+        if not self.has_router(router):
+            self.error(f"{where}: the router {router} does not exist")
+        elif not self.has_interface(router, interface):
+            self.error(f"{where}: {router} has no interface {interface}")
+
+
+def index_topology(data: Any) -> Index:
+    index = Index()
+    try:
+        read_topology(index, data)
+    except ValueError as e:  # a template or a pool that can't be used
+        index.error(f"topology.json: {e}")
+    return index
+
+
+def read_topology(index: Index, data: Any):
+    addressing = Addressing(data)
+    for name in addressing.duplicates:
+        index.error(f"topology.json: lan {name} is defined twice")
+    for name, full_address in addressing.lans.items():
+        try:
+            ip, prefixlen = parse_prefix(full_address)
+        except ValueError:
+            index.error(f"topology.json: lan {name} has an invalid address")
+            continue
+        index.lans[name.upper()] = (ip, prefixlen)
+
+    # the lans are sorted by address, so each one can only overlap the
+    # farthest reaching of the ones before it
+    networks = sorted(
+        (ip & get_mask(prefixlen), prefixlen, name)
+        for name, (ip, prefixlen) in index.lans.items()
+    )
+    farthest: tuple[str, int] | None = None
+    for network, prefixlen, name in networks:
+        broadcast = network | (~get_mask(prefixlen) & 0xFFFFFFFF)
+        if farthest is not None and network <= farthest[1]:
+            index.error(f"topology.json: lans {farthest[0]} and {name} overlap")
+        if farthest is None or broadcast > farthest[1]:
+            farthest = (name, broadcast)
+
+    addresses: dict[tuple[str, int], str] = {}
+    routers: dict[str, dict[str, str]] = data.get("routers", {})
+    for router, interfaces in expand_routers(routers):
+        if router in index.interfaces:
+            index.error(f"topology.json: router {router} is defined twice")
+        index.interfaces[router] = set()
+        for interface, interface_data in interfaces:
+            index.interfaces[router].add(interface)
+            where = f"topology.json: {router} {interface}"
+            words = interface_data.split()
+            if len(words) != 2:
+                index.error(f"{where}: expected '<byte> <lan>'")
+                continue
+            lan = words[1].upper()
+            if lan not in index.lans:
+                index.error(f"{where}: the lan {words[1]} does not exist")
+                continue
+            try:
+                ip = addressing.get_ip(lan, words[0])
+            except ValueError as e:
+                index.error(f"{where}: {e}")
+                continue
+            lan_ip, prefixlen = index.lans[lan]
+            network = lan_ip & get_mask(prefixlen)
+            broadcast = network | (~get_mask(prefixlen) & 0xFFFFFFFF)
+            if ip & get_mask(prefixlen) != network or (
+                prefixlen < 31 and ip in (network, broadcast)
+            ):
+                index.error(f"{where}: {format_ip(ip)} is not a host of lan {lan}")
+            elif (lan, ip) in addresses:
+                index.error(
+                    f"{where}: {format_ip(ip)} is already used by {addresses[lan, ip]}"
+                )
+            else:
+                addresses[lan, ip] = router
+
+    for line in expand_lines(data.get("defaults", [])):
+        words = line.split()
+        if len(words) != 2:
+            index.error(f"topology.json: default '{line}' should be '<router> <gw>'")
+            continue
+        index.check_routers("topology.json: defaults", words)
@@ -0,0 +1,123 @@
+import time
+import traceback
+from pathlib import Path
+from typing import Any
+from daemon import registry
+from topology.classes import Topology
+from topology.manifest import Changes, sync
+from topology.output import LabOutput
+from topology.parser import get_topology, parse_json
+from topology.validate import ValidationError
+from topology.wizard import (
+    get_affected,
+    merge_daemons,
+    render,
+    rerender,
+    validate_config,
+)
+
+
+class Watcher:
+    # Keeps the topology and the rendered lab in memory and, when a daemon json
+    # changes, re-renders only the routers with files that depend on the
+    # entries that changed. A change to topology.json regenerates everything.
+    def __init__(
+        self,
+        config: Path,
+        target: Path,
+        data: Path = Path("data"),
+        link: bool = False,
+        interval: float = 0.5,
+    ) -> None:
+        self.config = config
+        self.target = target
+        self.data = data
+        self.link = link
+        self.interval = interval
+        self.entries: dict[str, registry.Entry] = {
+            entry.get_file(): entry for entry in registry.get_entries().values()
+        }
+        self.files: dict[str, tuple[int, int]] = {}
+        self.topology: Topology | None = None
+        self.output = LabOutput()
+
+    def scan(self) -> dict[str, tuple[int, int]]:
+        result: dict[str, tuple[int, int]] = {}
+        for path in self.config.glob("*.json"):
+            stat = path.stat()
+            result[path.name] = (stat.st_mtime_ns, stat.st_size)
+        return result
+
+    def load(self, name: str) -> Any:
+        path = self.config.joinpath(name)
+        return parse_json(path) if path.exists() else None
+
+    def rebuild(self) -> Changes:
+        validate_config(self.config)
+        self.topology = None
+        topology = get_topology(self.config.joinpath("topology.json"))
+        self.output = render(self.config, topology, self.data)
+        changes = sync(self.output, self.target, self.link)
+        self.topology = topology
+        return changes
+
+    def update(self, changed: set[str]) -> Changes:
+        if self.topology is None or "topology.json" in changed:
+            return self.rebuild()
+        validate_config(self.config)
+        topology = self.topology
+
+        names = changed & self.entries.keys()
+        inputs = {
+            name: hashes
+            for name, hashes in self.output.inputs.items()
+            if name not in names
+        }
+        inputs.update(registry.get_inputs({name: self.load(name) for name in names}))
+        changes = registry.get_changes(self.output.inputs, inputs)
+        devices = get_affected(topology, self.output.get_dependents(changes), changes)
+        if devices is None:
+            return self.rebuild()
+
+        # a failure from now on leaves the models half merged
+        self.topology = None
+        for router in topology.routers:
+            router.clear_daemons()
+        merge_daemons(self.config, topology)
+        rerender(self.output, self.data, topology, devices)
+        self.output.inputs = inputs
+
+        self.topology = topology
+        return sync(self.output, self.target, self.link, devices=devices)
+
+    def run(self):
+        self.files = self.scan()
+        print(self.rebuild().get_summary())
+        print(f"Watching {self.config}...")
+        while True:
+            time.sleep(self.interval)
+            current = self.scan()
+            changed = {
+                name
+                for name in current.keys() | self.files.keys()
+                if current.get(name) != self.files.get(name)
+            }
+            if not changed:
+                continue
+            self.files = current
+            start = time.perf_counter()
+            try:
+                changes = self.update(changed)
+            except ValidationError as e:
+                print(e)
+                print("Fix the config to regenerate the lab")
+                continue
+            except Exception:
+                traceback.print_exc()
+                print("Fix the config to regenerate the lab")
+                continue
+            print(
+                f"{', '.join(sorted(changed))} changed "
+                f"({time.perf_counter() - start:.3f} s)"
+            )
+            print(changes.get_summary())
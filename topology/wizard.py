@@ -1,61 +1,328 @@
-import shutil
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from daemon.dns.parser import DNSParser
-from daemon.frr.frr import FRR
-from topology.classes import Topology
-from topology.parser import get_topology
+from typing import Any, Iterable
+from daemon import registry
+from topology import stats
+from topology.archive import FORMATS, write_archive
+from topology.classes import Router, Topology
+from topology.manifest import Changes, Manifest, get_device, sync
+from topology.output import BASE_TAG, LabOutput
+from topology.parser import get_topology, parse_json
+from topology.validate import ValidationError, index_topology
 
 
-def make_lab_conf(folder: Path, topology: Topology):
+def make_lab_conf(output: LabOutput, topology: Topology):
     lines: list[str] = []
     for router in topology.routers:
         for interface in router.interfaces.values():
             lines.append(f"{router.name}[{interface.number}]={interface.lan.name}\n")
         lines.append("\n")
-    with folder.joinpath("lab.conf").open("w") as file:
-        file.writelines(lines)
+    with output.tagged(BASE_TAG):
+        output.extend("lab.conf", lines)
 
 
-def make_startup_files(folder: Path, topology: Topology):
-    for router in topology.routers:
-        lines: list[str] = []
-        for interface in router.interfaces.values():
-            lines.append(f"ip a add {interface.full_address} dev {interface.name}\n")
-        if router.default_router is not None:
-            d_r =router.default_router
-            for iface in router.get_neighbors():
-                if iface.router is d_r:
-                    lines.append(f"ip route add default via {iface.address}\n")
-        with folder.joinpath(f"{router.name}.startup").open("w") as file:
-            file.writelines(lines)
+def make_startup_file(output: LabOutput, router: Router):
+    lines: list[str] = []
+    for interface in router.interfaces.values():
+        lines.append(f"ip a add {interface.full_address} dev {interface.name}\n")
+    if router.default_router is not None:
+        d_r =router.default_router
+        for iface in router.get_neighbors():
+            if iface.router is d_r:
+                lines.append(f"ip route add default via {iface.address}\n")
+    with output.tagged(BASE_TAG):
+        output.extend(f"{router.name}.startup", lines)
 
 
-def initialize_root(config: Path, folder: Path, topology: Topology):
+def make_startup_files(output: LabOutput, topology: Topology):
     for router in topology.routers:
-        path = folder.joinpath(router.name)
-        path.mkdir()
+        make_startup_file(output, router)
 
 
-def configure_daemons(folder: Path, data: Path, topology: Topology):
+def initialize_root(config: Path, output: LabOutput, topology: Topology):
     for router in topology.routers:
-        for daemon in router.daemons:
-            daemon.get_configurer().configure(
-                router, folder.joinpath(router.name), data
-            )
+        output.mkdir(router.name)
+
+
+def configure_router(output: LabOutput, data: Path, router: Router) -> LabOutput:
+    # each router renders into its own buffer, starting from its startup file,
+    # so the <router>.startup file appended by FRR and DNS is never shared
+    # between workers
+    local = output.select([f"{router.name}.startup"])
+    for daemon in router.daemons:
+        configurer = daemon.get_configurer()
+        with stats.timer("configurer", type(configurer).__name__):
+            with local.tagged(daemon.get_tag()):
+                with local.depends_on(*daemon.get_sources(router)):
+                    configurer.configure(router, local, data)
+    return local
+
+
+# state inherited by forked workers, so the topology is never pickled
+_forked: tuple[LabOutput, Path, Topology] | None = None
+
+
+def _configure_forked(index: int) -> tuple[LabOutput, Any]:
+    assert _forked is not None
+    output, data, topology = _forked
+    # the stats inherited from the parent are replaced by the ones of this task
+    recorder = stats.enable() if stats.recorder is not None else None
+    local = configure_router(output, data, topology.routers[index])
+    # generators can't be sent back to the parent
+    local.freeze()
+    return local, recorder.get_times() if recorder is not None else None
+
+
+def get_executor(jobs: int, processes: bool) -> Executor:
+    if processes and "fork" in multiprocessing.get_all_start_methods():
+        return ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork"))
+    return ThreadPoolExecutor(jobs)
+
+
+def configure_daemons(
+    output: LabOutput,
+    data: Path,
+    topology: Topology,
+    jobs: int = 1,
+    processes: bool = False,
+):
+    if jobs <= 1:
+        for router in topology.routers:
+            output.merge(configure_router(output, data, router))
+        return
+
+    global _forked
+    _forked = (output, data, topology)
+    try:
+        with get_executor(jobs, processes) as executor:
+            if isinstance(executor, ProcessPoolExecutor):
+                forked = list(
+                    executor.map(_configure_forked, range(len(topology.routers)))
+                )
+                results = [local for local, _ in forked]
+                for _, times in forked:
+                    if times is not None and stats.recorder is not None:
+                        stats.recorder.merge_times(times)
+            else:
+                results = list(
+                    executor.map(
+                        lambda router: configure_router(output, data, router),
+                        topology.routers,
+                    )
+                )
+            # merges in router order, so the output matches the serial run
+            for local in results:
+                output.merge(local)
+    finally:
+        _forked = None
+
+
+def rerender(output: LabOutput, data: Path, topology: Topology, names: Iterable[str]):
+    # renders the given routers again, from their startup file
+    router_map = topology.get_router_map()
+    names = sorted(names)
+    output.remove_devices(names)
+    for name in names:
+        router = router_map[name]
+        output.mkdir(name)
+        make_startup_file(output, router)
+        output.merge(configure_router(output, data, router))
+
+
+def get_affected(
+    topology: Topology, dependents: Iterable[str], changes: set[str]
+) -> set[str] | None:
+    # the devices with files that depend on the changed entries, and the
+    # routers named by the entries, that may depend on nothing yet. None when
+    # a file of the lab itself depends on them
+    routers = topology.get_router_map()
+    devices: set[str] = set()
+    for relative in dependents:
+        device = get_device(relative)
+        if device is None:
+            return None
+        devices.add(device)
+    for source in changes:
+        name = source.replace(":", "/").rpartition("/")[2]
+        if name == "*":
+            return set(routers)
+        if name in routers:
+            devices.add(name)
+    return devices
+
+
+# tags of the daemons in the order they are merged, which is the order of their
+# parts in the files they share
+DAEMON_TAGS = registry.get_tags()
+
+
+def get_tags(changed: Iterable[str]) -> set[str]:
+    # tags to render again when the given config files change
+    tags: set[str] = set()
+    for name in changed:
+        entry = registry.get_entry(name)
+        tags.add(entry.get_tag() if entry is not None else BASE_TAG)
+    return tags
+
+
+def validate_config(config: Path):
+    # checks every config file against the names in topology.json, and
+    # raises a ValidationError with all the problems before anything is built
+    try:
+        index = index_topology(parse_json(config.joinpath("topology.json")))
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        raise ValidationError([f"topology.json: {e}"])
+    for entry in registry.get_present(config):
+        name = entry.get_file()
+        try:
+            entry.load().validate(parse_json(config.joinpath(name)), index)
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            index.error(f"{name}: malformed file ({type(e).__name__}: {e})")
+    if index.errors:
+        raise ValidationError(index.errors)
+
+
+def merge_daemons(config: Path, topology: Topology, tags: set[str] | None = None):
+    registry.merge(config, topology, tags)
+
+
+def generate(
+    config: Path, data: Path, jobs: int = 1, processes: bool = False
+) -> LabOutput:
+    with stats.timer("phase", "validate"):
+        validate_config(config)
+    with stats.timer("phase", "parse"):
+        topology: Topology = get_topology(config.joinpath("topology.json"))
+    return render(config, topology, data, jobs, processes)
+
+
+def render(
+    config: Path,
+    topology: Topology,
+    data: Path,
+    jobs: int = 1,
+    processes: bool = False,
+) -> LabOutput:
+    output = LabOutput()
+    with stats.timer("phase", "lab.conf"):
+        make_lab_conf(output, topology)
+    with stats.timer("phase", "startup"):
+        make_startup_files(output, topology)
+        initialize_root(config, output, topology)
+
+    with stats.timer("phase", "merge"):
+        merge_daemons(config, topology)
+        output.inputs = registry.read_inputs(config)
+
+    with stats.timer("phase", "render"):
+        configure_daemons(output, data, topology, jobs, processes)
+    return output
+
+
+def configure_topology(
+    config: Path,
+    target: Path,
+    data: Path = Path("data"),
+    jobs: int = 1,
+    processes: bool = False,
+    link: bool = False,
+    format: str = "dir",
+) -> Changes:
+    # the whole lab is rendered in memory and only the changed files are written
+    output = generate(config, data, jobs, processes)
+    with stats.timer("phase", "write"):
+        if format in FORMATS:
+            return write_archive(output, target, format, link)
+        return sync(output, target, link)
+
+
+def rebuild(
+    config: Path,
+    target: Path,
+    tags: set[str],
+    data: Path = Path("data"),
+    jobs: int = 1,
+    processes: bool = False,
+    link: bool = False,
+) -> Changes:
+    # renders again only the files of the daemons with the given tags, taking
+    # the parts written by the other daemons from the manifest
+    old = Manifest.load(target) if target.exists() else None
+    if old is None or not old.tags or BASE_TAG in tags:
+        return configure_topology(config, target, data, jobs, processes, link)
+
+    with stats.timer("phase", "validate"):
+        validate_config(config)
+    with stats.timer("phase", "parse"):
+        topology: Topology = get_topology(config.joinpath("topology.json"))
+    output = LabOutput()
+    initialize_root(config, output, topology)
+    order = [BASE_TAG] + DAEMON_TAGS
+    for relative, parts in old.parts.items():
+        ordered = {
+            tag: parts.get(tag, "") for tag in order if tag in parts or tag in tags
+        }
+        ordered.update(parts)
+        for tag in tags:
+            ordered[tag] = ""
+        output.set_parts(relative, ordered, old.sources.get(relative, []))
 
+    with stats.timer("phase", "merge"):
+        merge_daemons(config, topology, tags)
+        output.inputs = registry.read_inputs(config)
+    with stats.timer("phase", "render"):
+        configure_daemons(output, data, topology, jobs, processes)
+    with stats.timer("phase", "write"):
+        return sync(
+            output,
+            target,
+            link,
+            lambda relative: output.exists(relative)
+            or not tags.isdisjoint(old.tags.get(relative, [])),
+        )
 
-def configure_topology(config: Path, target: Path, data: Path = Path("data")):
-    if target.exists():
-        shutil.rmtree(target.as_posix())
-    target.mkdir()
 
-    topology: Topology = get_topology(config.joinpath("topology.json"))
-    make_lab_conf(target, topology)
-    make_startup_files(target, topology)
-    initialize_root(config, target, topology)
+def refresh(
+    config: Path,
+    target: Path,
+    changed: Iterable[str],
+    data: Path = Path("data"),
+    jobs: int = 1,
+    processes: bool = False,
+    link: bool = False,
+) -> Changes:
+    # renders again only the devices whose files depend on the entries of the
+    # given config files that changed, from the sources in the manifest
+    old = Manifest.load(target) if target.exists() else None
+    names = {Path(name).name for name in changed}
+    if (
+        old is None
+        or not old.inputs
+        or any(registry.get_entry(name) is None for name in names)
+    ):
+        return configure_topology(config, target, data, jobs, processes, link)
 
-    FRR(config, topology)
-    if config.joinpath("dns.json").exists():
-        DNSParser(config.joinpath("dns.json")).merge(topology)
+    with stats.timer("phase", "validate"):
+        validate_config(config)
+    with stats.timer("phase", "parse"):
+        topology: Topology = get_topology(config.joinpath("topology.json"))
+    inputs = registry.read_inputs(config)
+    # the other files are taken as they were
+    current = {
+        name: hashes for name, hashes in old.inputs.items() if name not in names
+    }
+    current.update((name, inputs[name]) for name in names if name in inputs)
+    changes = registry.get_changes(old.inputs, current)
+    devices = get_affected(topology, old.get_dependents(changes), changes)
+    if devices is None:
+        return configure_topology(config, target, data, jobs, processes, link)
 
-    configure_daemons(target, data, topology)
+    output = LabOutput()
+    output.inputs = current
+    with stats.timer("phase", "merge"):
+        merge_daemons(config, topology)
+    with stats.timer("phase", "render"):
+        rerender(output, data, topology, devices)
+    with stats.timer("phase", "write"):
+        return sync(output, target, link, devices=devices)